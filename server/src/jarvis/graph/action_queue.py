@@ -0,0 +1,214 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import Future
+from dataclasses import asdict, dataclass, field
+from typing import Any, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.tools import BaseTool
+from langgraph.graph.graph import CompiledGraph
+from pydantic import ValidationError
+
+from jarvis import metrics
+from jarvis.graph.tool_executor import ToolExecutor
+
+_LOGGER = logging.getLogger(__name__)
+
+ACTION_CONCURRENCY = int(os.environ.get("ACTION_CONCURRENCY", 2))
+ACTION_TIMEOUT_SECONDS = float(os.environ.get("ACTION_TIMEOUT_SECONDS", 120))
+MAX_RECORDED_RUNS = 100
+ENABLE_ACTION_PLANS = os.environ.get("ENABLE_ACTION_PLANS", "true").lower() != "false"
+
+PLAN_PROMPT = """The instructions below were scheduled and it's now time to carry them out.
+Call the tools that carry them out, all at once, without asking anything.
+If they can't be done with these tools alone, don't call any."""
+
+RESUME_PROMPT = """{instructions}
+
+Part of this was already done, don't do it again:
+{done}"""
+
+
+@dataclass
+class ActionRun:
+    instructions: str
+    session_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    plan: Optional[List[List[dict]]] = None
+    status: str = "queued"
+    result: Optional[str] = None
+
+
+def _last_message(output: Any) -> str:
+    messages = output.get("messages") if isinstance(output, dict) else output.messages
+    return messages[-1].content if messages else ""
+
+
+class ActionQueue:
+    """Runs scheduled instructions as new conversations on the server's event
+    loop, directly against the compiled graph, with at most ACTION_CONCURRENCY
+    at a time. Instructions compiled into a plan of tool calls when scheduled
+    run those calls instead, without the LLM, and fall back to the graph if
+    any fails, telling it which calls already succeeded. `submit` can be
+    called from any thread (e.g. scheduler jobs); the last runs and their
+    results are kept for inspection."""
+
+    def __init__(self, concurrency: int = ACTION_CONCURRENCY):
+        self.concurrency = concurrency
+        self.graph: Optional[CompiledGraph] = None
+        self.executor: Optional[ToolExecutor] = None
+        self.planner: Optional[Any] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: list[asyncio.Task] = []
+        self._runs: deque[ActionRun] = deque(maxlen=MAX_RECORDED_RUNS)
+        # Submitted before `start`, e.g. actions caught up on startup
+        self._early: list[tuple[ActionRun, Future]] = []
+        self._lock = threading.Lock()
+
+    async def start(self, graph: CompiledGraph, llm: BaseChatModel, tools: List[BaseTool]):
+        self.graph = graph
+        self.executor = ToolExecutor(tools)
+        # Plans only use direct-return tools: their result is the answer, so
+        # nothing is left for the LLM to do when they run
+        direct_tools = [tool for tool in tools if tool.return_direct]
+        if ENABLE_ACTION_PLANS and direct_tools:
+            self.planner = llm.bind_tools(direct_tools)
+        self.loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        with self._lock:
+            for item in self._early:
+                self._queue.put_nowait(item)
+            self._early = []
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def compile(self, instructions: str) -> Optional[List[List[dict]]]:
+        """Resolves instructions into validated tool calls, or None when they
+        need the agent when they run."""
+        if self.planner is None or self.executor is None:
+            return None
+        try:
+            message = await self.planner.ainvoke(
+                [SystemMessage(content=PLAN_PROMPT), HumanMessage(content=instructions)]
+            )
+        except Exception as e:
+            _LOGGER.error(f"Error compiling \"{instructions}\": {repr(e)}")
+            return None
+        if not isinstance(message, AIMessage) or not message.tool_calls:
+            return None
+
+        step = []
+        for call in message.tool_calls:
+            tool = self.executor.tool_map.get(call["name"])
+            if tool is None or not tool.return_direct:
+                return None
+            args = call["args"]
+            if isinstance(tool.args_schema, type):
+                try:
+                    tool.args_schema.model_validate(args)
+                except ValidationError as e:
+                    _LOGGER.info(f"Not compiling \"{instructions}\", invalid {tool.name} call: {e}")
+                    return None
+            validate_args = getattr(tool, "validate_args", None)
+            if validate_args is not None:
+                result = await asyncio.to_thread(validate_args, args)
+                if not result.ok:
+                    _LOGGER.info(f"Not compiling \"{instructions}\": {result.errors}")
+                    return None
+                args = result.args
+            step.append({"name": tool.name, "args": args})
+        metrics.increment("actions.compiled")
+        return [step]
+
+    def submit(self, instructions: str, plan: Optional[List[List[dict]]] = None) -> Future:
+        """Queues a run; the returned future resolves to its final answer."""
+        run = ActionRun(instructions, plan=plan)
+        future: Future = Future()
+        self._runs.append(run)
+        with self._lock:
+            if self.loop is None or self._queue is None:
+                self._early.append((run, future))
+            else:
+                self.loop.call_soon_threadsafe(self._queue.put_nowait, (run, future))
+        metrics.increment("actions.submitted")
+        return future
+
+    async def _work(self):
+        assert self._queue is not None
+        while True:
+            run, future = await self._queue.get()
+            run.started_at = time.time()
+            run.status = "running"
+            metrics.observe("actions.queue_wait_seconds", run.started_at - run.submitted_at)
+            try:
+                run.result = await asyncio.wait_for(self._execute(run), ACTION_TIMEOUT_SECONDS)
+                run.status = "done"
+                metrics.increment("actions.done")
+                future.set_result(run.result)
+            except Exception as e:
+                _LOGGER.error(f"Error running action \"{run.instructions}\": {repr(e)}")
+                run.result = repr(e)
+                run.status = "failed"
+                metrics.increment("actions.failed")
+                future.set_exception(e)
+            finally:
+                run.finished_at = time.time()
+                metrics.observe("actions.run_seconds", run.finished_at - run.started_at)
+                self._queue.task_done()
+
+    async def _execute(self, run: ActionRun) -> str:
+        question = run.instructions
+        if run.plan and self.executor is not None:
+            result, done = await self._run_plan(run.plan)
+            if result is not None:
+                metrics.increment("actions.plan_runs")
+                return result
+            _LOGGER.info(f"Plan for \"{run.instructions}\" failed, falling back to the agent")
+            metrics.increment("actions.plan_fallbacks")
+            # The agent only finishes what's left, succeeded calls aren't replayed
+            if done:
+                question = RESUME_PROMPT.format(instructions=run.instructions, done="\n".join(done))
+        output = await self.graph.ainvoke(  # type: ignore
+            {"question": question},
+            config={"configurable": {"session_id": run.session_id}},
+        )
+        return str(_last_message(output))
+
+    async def _run_plan(self, plan: List[List[dict]]) -> tuple[Optional[str], List[str]]:
+        """The answer, or None if a call failed, along with the calls that
+        succeeded and their results."""
+        assert self.executor is not None
+        counters: Counter = Counter()
+        outputs: List[str] = []
+        done: List[str] = []
+        for step in plan:
+            tool_calls = [
+                {**call, "id": f"action_{uuid.uuid4().hex}", "type": "tool_call"}
+                for call in step
+            ]
+            tools_return = await self.executor.abatch(tool_calls, counters)
+            done += [
+                f"- {call['name']}({json.dumps(call['args'], ensure_ascii=False)}): {m.content}"
+                for call, m in zip(tool_calls, tools_return)
+                if m.status != "error"
+            ]
+            if any(m.status == "error" for m in tools_return):
+                return None, done
+            reply = self.executor.render_direct_reply(tool_calls, tools_return)
+            outputs.append(reply if reply is not None else " ".join(str(m.content) for m in tools_return))
+        return " ".join(outputs), done
+
+    def runs(self) -> list[dict[str, Any]]:
+        return [asdict(run) for run in reversed(self._runs)]
+
+
+action_queue = ActionQueue()
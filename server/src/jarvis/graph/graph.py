@@ -1,5 +1,7 @@
 from typing import List, Any, Optional, Literal, Callable, Awaitable
+from collections import Counter
 from datetime import datetime
+import logging
 import uuid
 import os
 
@@ -11,19 +13,25 @@ from langchain_core.messages import (
     AIMessage,
     SystemMessage,
 )
-from langchain_core.runnables import RunnableLambda
 from langchain_core.runnables.config import RunnableConfig
 from langchain_core.tools import BaseTool
 from langgraph.graph import END, StateGraph
 from langgraph.graph.graph import CompiledGraph
 
+from jarvis import metrics
 from jarvis.graph.types import AgentState
+from jarvis.graph.tool_executor import ToolExecutor
+from jarvis.graph.macros import macro_store, extract_turn
 from jarvis.graph.compressor_chain import (
     retrieve_filtered_chat_history,
     get_summary,
     persist_history,
 )
 
+_LOGGER = logging.getLogger(__name__)
+
+ENABLE_MACROS = os.environ.get("ENABLE_MACROS", "true").lower() != "false"
+
 
 def make_system_prompt() -> SystemMessage:
     return SystemMessage(
@@ -57,21 +65,8 @@ def generate_graph(
     tools: List[BaseTool],
 ) -> CompiledGraph:
     llm_with_tools = llm.bind_tools(tools)
-    tool_map = {tool.name: tool for tool in tools}
-
-    def _invoke_tool(tool_call: Any):
-        return ToolMessage(
-            content=tool_map[tool_call["name"]].invoke(input=tool_call["args"]),
-            tool_call_id=tool_call["id"],
-        )
-
-    async def _ainvoke_tool(tool_call: Any):
-        return ToolMessage(
-            content=await tool_map[tool_call["name"]].ainvoke(input=tool_call["args"]),
-            tool_call_id=tool_call["id"],
-        )
-
-    tool_executor = RunnableLambda(_invoke_tool, _ainvoke_tool)
+    tool_executor = ToolExecutor(tools)
+    direct_tools = {tool.name for tool in tools if tool.return_direct}
 
     async def should_call_tools(
         state: AgentState, _config: Optional[RunnableConfig] = None
@@ -99,14 +94,81 @@ def generate_graph(
         state: AgentState, _config: Optional[RunnableConfig] = None
     ) -> AgentState:
         last_msg = state.messages[-1]
-        tools_return = []
+        tools_return: List[ToolMessage] = []
+        counters: Counter = Counter()
         if isinstance(last_msg, AIMessage) and last_msg.tool_calls:
-            tools_return = await tool_executor.abatch(last_msg.tool_calls)
+            tools_return = await tool_executor.abatch(last_msg.tool_calls, counters)
+
+        # Any failed call sends the model into another iteration to recover
+        if any(m.status == "error" for m in tools_return):
+            counters["llm_retries"] += 1
+
+        direct_reply = (
+            tool_executor.render_direct_reply(last_msg.tool_calls, tools_return)
+            if isinstance(last_msg, AIMessage)
+            else None
+        )
+        if direct_reply is not None:
+            counters["direct_replies"] += 1
+
+        return state.copy_with(
+            append_messages=[
+                *tools_return,
+                *([AIMessage(content=direct_reply)] if direct_reply is not None else []),
+            ],
+            add_counters=dict(counters),
+        )
+
+    async def should_call_agent(
+        state: AgentState, _config: Optional[RunnableConfig] = None
+    ) -> Literal["yes", "no"]:
+        # A direct reply from the tools already answers the user
+        if isinstance(state.messages[-1], AIMessage):
+            return "no"
+        return "yes"
+
+    async def run_macro(
+        state: AgentState, _config: Optional[RunnableConfig] = None
+    ) -> AgentState:
+        if not ENABLE_MACROS:
+            return state
+        match = await macro_store.match(state.question)
+        if match is None:
+            return state
+
+        macro_id, plan = match
+        _LOGGER.info(f"Replaying macro {macro_id} for {state.question!r}")
+        messages: List[BaseMessage] = []
+        counters: Counter = Counter({"macro_runs": 1})
+        for step in plan:
+            tool_calls = [
+                {**call, "id": f"macro_{uuid.uuid4().hex}", "type": "tool_call"}
+                for call in step
+            ]
+            tools_return = await tool_executor.abatch(tool_calls, counters)
+            messages += [AIMessage(content="", tool_calls=tool_calls), *tools_return]
+            reply = tool_executor.render_direct_reply(tool_calls, tools_return)
+            if reply is None:
+                # Let the agent take over from whatever was already done
+                _LOGGER.info(f"Macro {macro_id} failed, falling back to the agent")
+                counters["macro_fallbacks"] += 1
+                await macro_store.record_run(macro_id, succeeded=False)
+                return state.copy_with(
+                    append_messages=messages, add_counters=dict(counters)
+                )
 
+        await macro_store.record_run(macro_id, succeeded=True)
         return state.copy_with(
-            append_messages=list(tools_return),
+            append_messages=[*messages, AIMessage(content=reply)],
+            add_counters=dict(counters),
+            macro_id=macro_id,
         )
 
+    async def should_call_agent_after_macro(
+        state: AgentState, _config: Optional[RunnableConfig] = None
+    ) -> Literal["yes", "no"]:
+        return "no" if state.macro_id is not None else "yes"
+
     async def assoc_history(
         state: AgentState, config: Optional[RunnableConfig] = None
     ) -> AgentState:
@@ -165,12 +227,29 @@ def generate_graph(
             (config or {}).get("configurable", {}).get("session_id", "fallback")
         )
         store[session_id] = list(state.messages)
+
+        # After a macro fell back, the calls it made weren't the model's choice
+        if (
+            ENABLE_MACROS
+            and state.macro_id is None
+            and not state.counters.get("macro_fallbacks")
+        ):
+            question, steps, answered = extract_turn(state.messages)
+            if question and answered:
+                await macro_store.record_turn(question, steps, direct_tools)
+
+        metrics.increment("turns")
+        for name, value in state.counters.items():
+            metrics.increment(f"turns.{name}", value)
+        if state.counters:
+            _LOGGER.info(f"Turn counters: {state.counters}")
         return state
 
     workflow = StateGraph(AgentState)
     workflow.add_node("assoc_history", assoc_history)
     workflow.add_node("assoc_summary", assoc_summary(llm))
     workflow.add_node("assoc_messages", assoc_messages)
+    workflow.add_node("run_macro", run_macro)
     workflow.add_node("agent", call_agent)
     workflow.add_node("tools", call_tools)
     workflow.add_node("persist_messages", persist_messages)
@@ -179,7 +258,15 @@ def generate_graph(
 
     workflow.add_edge("assoc_history", "assoc_summary")
     workflow.add_edge("assoc_summary", "assoc_messages")
-    workflow.add_edge("assoc_messages", "agent")
+    workflow.add_edge("assoc_messages", "run_macro")
+    workflow.add_conditional_edges(
+        "run_macro",
+        should_call_agent_after_macro,
+        {
+            "yes": "agent",
+            "no": "persist_messages",
+        },
+    )
     workflow.add_conditional_edges(
         "agent",
         should_call_tools,
@@ -188,7 +275,14 @@ def generate_graph(
             "no": "persist_messages",
         },
     )
-    workflow.add_edge("tools", "agent")
+    workflow.add_conditional_edges(
+        "tools",
+        should_call_agent,
+        {
+            "yes": "agent",
+            "no": "persist_messages",
+        },
+    )
     workflow.add_edge("persist_messages", END)
 
     # memory = AsyncSqliteSaver.from_conn_string("chat_history.db")
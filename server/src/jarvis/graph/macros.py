@@ -0,0 +1,294 @@
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, List, Optional
+
+import aiosqlite
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+
+_LOGGER = logging.getLogger(__name__)
+
+MACROS_DB = os.environ.get("MACROS_DB", "macros.db")
+MACRO_MIN_SUPPORT = int(os.environ.get("MACRO_MIN_SUPPORT", 3))
+MACRO_MIN_CONFIDENCE = float(os.environ.get("MACRO_MIN_CONFIDENCE", 0.8))
+# Macros are mined from the last turns of each question, so support and
+# confidence follow recent behaviour, and one-off questions are forgotten
+MACRO_MAX_TURNS = int(os.environ.get("MACRO_MAX_TURNS", 20))
+MACRO_TURN_MAX_AGE_DAYS = int(os.environ.get("MACRO_TURN_MAX_AGE_DAYS", 90))
+
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+def normalize_question(question: str) -> str:
+    """Lowercases, strips accents and punctuation, so "Boa noite!" and "boa
+    noite" are the same command."""
+    text = unicodedata.normalize("NFKD", question.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s.,%]", " ", text)
+    text = re.sub(r"(?<!\d)[.,]|[.,](?!\d)", " ", text)
+    return " ".join(text.split())
+
+
+def _parse_number(text: str) -> float | int:
+    number = float(text.replace(",", "."))
+    return int(number) if number.is_integer() else number
+
+
+def _parameterize(question: str) -> tuple[str, str, List[float | int]]:
+    """Returns the normalized question, its template with numbers replaced by
+    placeholders and the numbers themselves."""
+    normalized = normalize_question(question)
+    numbers = [_parse_number(n) for n in _NUMBER.findall(normalized)]
+    counter = iter(range(len(numbers)))
+    template = _NUMBER.sub(lambda _: f"{{{next(counter)}}}", normalized)
+    return normalized, template, numbers
+
+
+def _replace_values(value: Any, numbers: List[float | int]) -> tuple[Any, set[int]]:
+    """Replaces numbers coming from the question by {"$param": i} markers."""
+    if isinstance(value, dict):
+        used: set[int] = set()
+        replaced = {}
+        for k, v in value.items():
+            replaced[k], u = _replace_values(v, numbers)
+            used |= u
+        return replaced, used
+    if isinstance(value, list):
+        used = set()
+        replaced_list = []
+        for v in value:
+            r, u = _replace_values(v, numbers)
+            replaced_list.append(r)
+            used |= u
+        return replaced_list, used
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value in numbers:
+        index = numbers.index(value)
+        return {"$param": index}, {index}
+    return value, set()
+
+
+def _fill_values(value: Any, numbers: List[float | int]) -> Any:
+    if isinstance(value, dict):
+        if set(value.keys()) == {"$param"}:
+            return numbers[value["$param"]]
+        return {k: _fill_values(v, numbers) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_fill_values(v, numbers) for v in value]
+    return value
+
+
+def extract_turn(messages: List[BaseMessage]) -> tuple[Optional[str], List[List[dict]], bool]:
+    """Finds the last question in `messages` and the tool calls (grouped by step)
+    that successfully answered it."""
+    start = max(
+        (i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=None
+    )
+    if start is None:
+        return None, [], False
+
+    failed_ids = {
+        m.tool_call_id
+        for m in messages[start:]
+        if isinstance(m, ToolMessage) and m.status == "error"
+    }
+    steps = []
+    for message in messages[start + 1 :]:
+        if isinstance(message, AIMessage) and message.tool_calls:
+            step = [
+                {"name": call["name"], "args": call["args"]}
+                for call in message.tool_calls
+                if call["id"] not in failed_ids
+            ]
+            if step:
+                steps.append(step)
+    answered = isinstance(messages[-1], AIMessage) and not messages[-1].tool_calls
+    return str(messages[start].content), steps, answered
+
+
+def prune_plan(steps: List[List[dict]], direct_tools: set[str]) -> List[List[dict]]:
+    """Keeps only direct-return calls. Lookups made before them just helped the
+    model find arguments, which are now fixed, but a lookup made after the last
+    action means the answer depended on it, so the turn can't be replayed."""
+    last_direct = max(
+        (i for i, step in enumerate(steps) if all(c["name"] in direct_tools for c in step)),
+        default=None,
+    )
+    if last_direct is None or last_direct != len(steps) - 1:
+        return []
+    pruned = [[c for c in step if c["name"] in direct_tools] for step in steps]
+    return [step for step in pruned if step]
+
+
+class MacroStore:
+    def __init__(self, path: str = MACROS_DB):
+        self.path = path
+        self._initialized = False
+
+    @asynccontextmanager
+    async def _connect(self) -> AsyncIterator[aiosqlite.Connection]:
+        async with aiosqlite.connect(self.path) as db:
+            db.row_factory = aiosqlite.Row
+            if not self._initialized:
+                await self._create_tables(db)
+            yield db
+
+    async def _create_tables(self, db: aiosqlite.Connection) -> None:
+        await db.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS turns (
+                id INTEGER PRIMARY KEY,
+                template TEXT NOT NULL,
+                plan TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS turns_template ON turns (template);
+            CREATE TABLE IF NOT EXISTS macros (
+                id INTEGER PRIMARY KEY,
+                template TEXT NOT NULL UNIQUE,
+                plan TEXT NOT NULL,
+                support INTEGER NOT NULL,
+                confidence REAL NOT NULL,
+                pinned INTEGER NOT NULL DEFAULT 0,
+                runs INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            );
+            """
+        )
+        self._initialized = True
+
+    async def record_turn(
+        self, question: str, steps: List[List[dict]], direct_tools: set[str]
+    ) -> None:
+        normalized, template, numbers = _parameterize(question)
+        plan, used = _replace_values(prune_plan(steps, direct_tools), numbers)
+        # Only treat numbers as parameters when the plan uses all of them,
+        # otherwise "luz 2" and "luz 3" could be different devices.
+        if numbers and used != set(range(len(numbers))):
+            template, plan = normalized, prune_plan(steps, direct_tools)
+
+        async with self._connect() as db:
+            await db.execute(
+                "INSERT INTO turns (template, plan, created_at) VALUES (?, ?, ?)",
+                (template, json.dumps(plan, sort_keys=True), time.time()),
+            )
+            await self._prune(db, template)
+            await self._mine(db, template)
+            await db.commit()
+
+    async def record_run(self, macro_id: int, succeeded: bool) -> None:
+        """Counts a replay as a turn of its template: the macro's plan when it
+        answered, no plan when it fell back to the agent. Turns stop being
+        recorded once a macro matches, so this is what keeps it honest."""
+        async with self._connect() as db:
+            cursor = await db.execute(
+                "SELECT template, plan FROM macros WHERE id = ?", (macro_id,)
+            )
+            row = await cursor.fetchone()
+            if row is None:
+                return
+            await db.execute(
+                "INSERT INTO turns (template, plan, created_at) VALUES (?, ?, ?)",
+                (row["template"], row["plan"] if succeeded else "[]", time.time()),
+            )
+            await self._prune(db, row["template"])
+            await self._mine(db, row["template"])
+            await db.commit()
+
+    async def _prune(self, db: aiosqlite.Connection, template: str) -> None:
+        await db.execute(
+            """DELETE FROM turns WHERE id IN (
+                SELECT id FROM turns WHERE template = ? ORDER BY id DESC LIMIT -1 OFFSET ?
+            )""",
+            (template, MACRO_MAX_TURNS),
+        )
+        await db.execute(
+            "DELETE FROM turns WHERE created_at < ?",
+            (time.time() - MACRO_TURN_MAX_AGE_DAYS * 24 * 60 * 60,),
+        )
+
+    async def _mine(self, db: aiosqlite.Connection, template: str) -> None:
+        cursor = await db.execute(
+            "SELECT plan, COUNT(*) AS n FROM turns WHERE template = ? GROUP BY plan ORDER BY n DESC",
+            (template,),
+        )
+        rows = list(await cursor.fetchall())
+        total = sum(r["n"] for r in rows)
+        best = next((r for r in rows if r["plan"] != "[]"), None)
+        if best is None or best["n"] < MACRO_MIN_SUPPORT:
+            # Pinned macros stay, the others are unlearnt
+            await db.execute(
+                "DELETE FROM macros WHERE template = ? AND NOT pinned", (template,)
+            )
+            return
+        await db.execute(
+            """INSERT INTO macros (template, plan, support, confidence, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (template) DO UPDATE SET
+                plan = CASE WHEN pinned THEN plan ELSE excluded.plan END,
+                support = excluded.support,
+                confidence = excluded.confidence,
+                updated_at = excluded.updated_at""",
+            (template, best["plan"], best["n"], best["n"] / total, time.time()),
+        )
+
+    async def match(self, question: str) -> Optional[tuple[int, List[List[dict]]]]:
+        """Returns the macro id and its filled plan for a known question."""
+        normalized, template, numbers = _parameterize(question)
+        async with self._connect() as db:
+            cursor = await db.execute(
+                """SELECT id, template, plan FROM macros
+                WHERE template IN (?, ?)
+                AND (pinned OR (support >= ? AND confidence >= ?))
+                ORDER BY template = ? DESC LIMIT 1""",
+                (
+                    normalized,
+                    template,
+                    MACRO_MIN_SUPPORT,
+                    MACRO_MIN_CONFIDENCE,
+                    normalized,
+                ),
+            )
+            row = await cursor.fetchone()
+            if row is None:
+                return None
+            await db.execute("UPDATE macros SET runs = runs + 1 WHERE id = ?", (row["id"],))
+            await db.commit()
+
+        plan = json.loads(row["plan"])
+        if row["template"] != normalized:
+            plan = _fill_values(plan, numbers)
+        return row["id"], plan
+
+    async def list(self) -> List[dict[str, Any]]:
+        async with self._connect() as db:
+            cursor = await db.execute("SELECT * FROM macros ORDER BY runs DESC, support DESC")
+            return [
+                {**dict(row), "plan": json.loads(row["plan"]), "pinned": bool(row["pinned"])}
+                for row in await cursor.fetchall()
+            ]
+
+    async def pin(self, macro_id: int, pinned: bool = True) -> bool:
+        async with self._connect() as db:
+            cursor = await db.execute(
+                "UPDATE macros SET pinned = ? WHERE id = ?", (int(pinned), macro_id)
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+
+    async def delete(self, macro_id: int) -> bool:
+        async with self._connect() as db:
+            cursor = await db.execute(
+                "DELETE FROM turns WHERE template = (SELECT template FROM macros WHERE id = ?)",
+                (macro_id,),
+            )
+            cursor = await db.execute("DELETE FROM macros WHERE id = ?", (macro_id,))
+            await db.commit()
+            return cursor.rowcount > 0
+
+
+macro_store = MacroStore()
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from collections import Counter
+from difflib import get_close_matches
+from typing import Any, List, Optional
+import os
+
+from langchain_core.messages import ToolMessage
+from langchain_core.tools import BaseTool
+
+from jarvis import metrics
+
+_LOGGER = logging.getLogger(__name__)
+
+# Every tool in this repo reports failures with this prefix instead of raising
+TOOL_ERROR_PREFIX = "Sorry, I can't do that"
+RESPONSE_LANGUAGE = os.environ.get("RESPONSE_LANGUAGE", "pt-BR")
+
+
+class _KeepMissing(dict):
+    def __missing__(self, key: str) -> str:
+        return f"{{{key}}}"
+
+
+def is_error_output(content: Any) -> bool:
+    return isinstance(content, str) and content.startswith(TOOL_ERROR_PREFIX)
+
+
+class ToolExecutor:
+    """Runs tool calls, validating their arguments first when the tool knows how
+    to (see `validate_args` on Home Assistant tools), so that invented entities
+    are fixed or rejected without a network call."""
+
+    def __init__(self, tools: List[BaseTool]):
+        self.tool_map = {tool.name: tool for tool in tools}
+
+    def _count(self, counters: Optional[Counter], name: str):
+        metrics.increment(f"tools.{name}")
+        if counters is not None:
+            counters[name] += 1
+
+    async def ainvoke(
+        self, tool_call: dict[str, Any], counters: Optional[Counter] = None
+    ) -> ToolMessage:
+        tool = self.tool_map.get(tool_call["name"])
+        if tool is None:
+            self._count(counters, "validation_rejected")
+            suggestions = get_close_matches(tool_call["name"], self.tool_map.keys())
+            return ToolMessage(
+                content=f"{TOOL_ERROR_PREFIX} (unknown tool, did you mean {', '.join(suggestions) or 'another tool'}?)",
+                tool_call_id=tool_call["id"],
+                status="error",
+            )
+
+        args = tool_call["args"]
+        note = ""
+        validate_args = getattr(tool, "validate_args", None)
+        if validate_args is not None:
+            result = await asyncio.to_thread(validate_args, args)
+            if not result.ok:
+                self._count(counters, "validation_rejected")
+                _LOGGER.info(f"Rejected {tool.name} call: {result.errors}")
+                return ToolMessage(
+                    content=result.to_message(),
+                    tool_call_id=tool_call["id"],
+                    status="error",
+                )
+            if result.corrections:
+                self._count(counters, "validation_corrected")
+                _LOGGER.info(f"Corrected {tool.name} call: {result.corrections}")
+                note = "".join(
+                    f"Note: used {new} instead of {old}.\n"
+                    for old, new in result.corrections.items()
+                )
+            args = result.args
+
+        content = await tool.ainvoke(input=args)
+        status = "success"
+        if is_error_output(content):
+            self._count(counters, "tool_errors")
+            status = "error"
+        return ToolMessage(
+            content=f"{note}{content}" if note else content,
+            tool_call_id=tool_call["id"],
+            status=status,
+        )
+
+    def render_direct_reply(
+        self,
+        tool_calls: List[dict[str, Any]],
+        tool_messages: List[ToolMessage],
+        language: str = RESPONSE_LANGUAGE,
+    ) -> Optional[str]:
+        """Renders the final answer from the tools' response templates when every
+        call is direct-return and succeeded, so the agent can skip its last turn."""
+        if not tool_calls or len(tool_calls) != len(tool_messages):
+            return None
+
+        replies: List[str] = []
+        for tool_call, message in zip(tool_calls, tool_messages):
+            tool = self.tool_map.get(tool_call["name"])
+            # Tools whose reply depends on the arguments pick the template
+            pick_template = getattr(tool, "response_template", None)
+            template = (
+                pick_template(tool_call["args"], language)
+                if pick_template is not None
+                else getattr(tool, "response_templates", {}).get(language)
+            )
+            if (
+                tool is None
+                or not tool.return_direct
+                or template is None
+                or message.status == "error"
+            ):
+                return None
+            reply = template.format_map(_KeepMissing(tool_call["args"]))
+            if reply not in replies:
+                replies.append(reply)
+        return " ".join(replies)
+
+    async def abatch(
+        self, tool_calls: List[dict[str, Any]], counters: Optional[Counter] = None
+    ) -> List[ToolMessage]:
+        return list(
+            await asyncio.gather(*[self.ainvoke(call, counters) for call in tool_calls])
+        )
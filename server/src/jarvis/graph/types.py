@@ -1,4 +1,5 @@
-from typing import List
+from typing import List, Optional
+from collections import Counter
 from langchain_core.messages import BaseMessage
 from pydantic import BaseModel
 
@@ -8,12 +9,18 @@ class AgentState(BaseModel):
     system_messages: List[BaseMessage] = []
     messages: List[BaseMessage] = []
     question: str
+    # Per-turn tool execution counters, e.g. validation_rejected or llm_retries
+    counters: dict[str, int] = {}
+    # Set when the turn was answered by replaying a learned macro
+    macro_id: Optional[int] = None
 
     def copy_with(
         self: "AgentState",
         append_messages: List[BaseMessage] = [],
         replace_filtered_chat_history: List[BaseMessage] = [],
         append_system_messages: List[BaseMessage] = [],
+        add_counters: dict[str, int] = {},
+        macro_id: Optional[int] = None,
     ) -> "AgentState":
         return AgentState(
             filtered_chat_history=replace_filtered_chat_history
@@ -21,4 +28,6 @@ class AgentState(BaseModel):
             system_messages=[*self.system_messages, *append_system_messages],
             messages=[*self.messages, *append_messages],
             question=self.question or self.question,
+            counters=dict(Counter(self.counters) + Counter(add_counters)),
+            macro_id=macro_id or self.macro_id,
         )
@@ -0,0 +1,38 @@
+import threading
+from collections import defaultdict
+from typing import Any
+
+_lock = threading.Lock()
+_counters: dict[str, float] = defaultdict(float)
+_timings: dict[str, dict[str, float]] = {}
+
+
+def increment(name: str, value: float = 1) -> None:
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, value: float) -> None:
+    """Records a sample (e.g. a duration in seconds) keeping count, sum, last and max."""
+    with _lock:
+        timing = _timings.setdefault(
+            name, {"count": 0, "sum": 0.0, "last": 0.0, "max": 0.0}
+        )
+        timing["count"] += 1
+        timing["sum"] += value
+        timing["last"] = value
+        timing["max"] = max(timing["max"], value)
+
+
+def snapshot() -> dict[str, Any]:
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "timings": {
+                name: {
+                    **timing,
+                    "avg": timing["sum"] / timing["count"] if timing["count"] else 0,
+                }
+                for name, timing in _timings.items()
+            },
+        }
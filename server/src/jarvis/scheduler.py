@@ -0,0 +1,112 @@
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable
+
+from apscheduler.events import (
+    EVENT_JOB_ERROR,
+    EVENT_JOB_EXECUTED,
+    EVENT_JOB_MISSED,
+    EVENT_JOB_SUBMITTED,
+    JobExecutionEvent,
+    JobSubmissionEvent,
+)
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from jarvis import metrics
+
+SCHEDULER_DB_URL = os.environ.get("SCHEDULER_DB_URL", "sqlite:///scheduled_actions.db")
+# Actions missed by up to this long (e.g. during a deploy) still run on startup
+SCHEDULER_MISFIRE_GRACE_SECONDS = int(os.environ.get("SCHEDULER_MISFIRE_GRACE_SECONDS", 6 * 60 * 60))
+# Threads for jobs that block (Google API syncs...), coroutine jobs run on the loop
+SCHEDULER_MAX_WORKERS = int(os.environ.get("SCHEDULER_MAX_WORKERS", 4))
+# Wall-clock triggers ("every weekday at 7a.m.") follow the user's timezone,
+# not the container's
+SCHEDULER_TIMEZONE = os.environ.get("SCHEDULER_TIMEZONE", "America/Sao_Paulo")
+
+# Store for scheduled actions: they live in SQLite and survive restarts. It's
+# indexed by next run time, so only the next due jobs are ever looked at.
+ACTIONS_JOBSTORE = "actions"
+BLOCKING_EXECUTOR = "blocking"
+
+# The one scheduler of the server, running on its event loop
+scheduler = AsyncIOScheduler(
+    jobstores={
+        "default": MemoryJobStore(),
+        ACTIONS_JOBSTORE: SQLAlchemyJobStore(url=SCHEDULER_DB_URL),
+    },
+    executors={
+        "default": AsyncIOExecutor(),
+        BLOCKING_EXECUTOR: ThreadPoolExecutor(SCHEDULER_MAX_WORKERS),
+    },
+    job_defaults={
+        "misfire_grace_time": SCHEDULER_MISFIRE_GRACE_SECONDS,
+        # Runs of the same job missed during downtime fire once, not once each
+        "coalesce": True,
+        "max_instances": 1,
+    },
+    timezone=SCHEDULER_TIMEZONE,
+)
+
+_submitted: dict[tuple[str, str], float] = {}
+
+
+def _metric_name(event: JobSubmissionEvent | JobExecutionEvent) -> str:
+    # Actions have random ids, they're reported together
+    return ACTIONS_JOBSTORE if event.jobstore == ACTIONS_JOBSTORE else event.job_id
+
+
+def _on_submitted(event: JobSubmissionEvent):
+    now = time.time()
+    _submitted[(event.jobstore, event.job_id)] = now
+    if event.scheduled_run_times:
+        lag = now - event.scheduled_run_times[-1].timestamp()
+        metrics.observe(f"scheduler.{_metric_name(event)}.lag_seconds", max(lag, 0.0))
+
+
+def _on_finished(event: JobExecutionEvent):
+    name = _metric_name(event)
+    if event.code == EVENT_JOB_MISSED:
+        metrics.increment(f"scheduler.{name}.missed")
+        return
+    started = _submitted.pop((event.jobstore, event.job_id), None)
+    if started is not None:
+        metrics.observe(f"scheduler.{name}.run_seconds", time.time() - started)
+    # APScheduler already logs the exception itself
+    if event.exception:
+        metrics.increment(f"scheduler.{name}.errors")
+
+
+scheduler.add_listener(_on_submitted, EVENT_JOB_SUBMITTED)
+scheduler.add_listener(_on_finished, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+
+
+def add_periodic_job(job_id: str, func: Callable[[], Any], minutes: float, blocking: bool = True):
+    """Runs `func` right away and then every `minutes`."""
+    scheduler.add_job(
+        func,
+        "interval",
+        id=job_id,
+        minutes=minutes,
+        next_run_time=datetime.now(timezone.utc),
+        executor=BLOCKING_EXECUTOR if blocking else "default",
+        replace_existing=True,
+    )
+
+
+def run_soon(job_id: str, func: Callable[[], Any], blocking: bool = True):
+    """Brings the job `job_id` forward to now, or runs `func` once if there's
+    no such job. Safe to call from any thread."""
+    if scheduler.get_job(job_id) is not None:
+        scheduler.modify_job(job_id, next_run_time=datetime.now(timezone.utc))
+        return
+    scheduler.add_job(
+        func,
+        id=f"{job_id}_once",
+        executor=BLOCKING_EXECUTOR if blocking else "default",
+        replace_existing=True,
+    )
@@ -1,5 +1,5 @@
 from asyncio import Task
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 import asyncio
 import logging
 import os
@@ -16,12 +16,24 @@ from langserve import add_routes
 
 from jarvis.tools.homeassistant.toolkit import HomeAssistantToolkit
 from jarvis.tools.google.toolkit import GoogleToolkit
-from jarvis.tools.google.base import refresh_google_token
+from jarvis.tools.google.calendar_mirror import calendar_mirror
+from jarvis.tools.google.tasks_mirror import tasks_mirror
+from jarvis.tools.google.gmail import gmail_index
 from jarvis.tools.matrix.toolkit import MatrixToolkit
+from jarvis.tools.matrix.service import matrix_service
 from jarvis.tools.beancount import BeancountAddTransactionTool
-from jarvis.tools.schedule_action import ScheduleActionTool
+from jarvis.tools.beancount_ledger import beancount_ledger
+from jarvis.tools.schedule_action import (
+    ScheduleActionTool,
+    ListScheduledActionsTool,
+    CancelScheduledActionTool,
+)
 from jarvis.graph.graph import generate_graph
+from jarvis.graph.macros import macro_store
+from jarvis.graph.action_queue import action_queue
 from jarvis.tools.overseer.toolkit import OverseerToolkit
+from jarvis import metrics
+from jarvis.scheduler import add_periodic_job, scheduler
 
 
 DEBUG = os.environ.get("DEBUG")
@@ -52,6 +64,8 @@ llm = get_llm()
 
 tools = [
     ScheduleActionTool(),
+    ListScheduledActionsTool(),
+    CancelScheduledActionTool(),
     BeancountAddTransactionTool(),
     # SaveLongTermFactsMemoryTool(llm=llm),
     # LoadLongTermFactsMemoryTool(llm=llm),
@@ -61,7 +75,7 @@ tools += HomeAssistantToolkit(
 ).get_tools()
 tools += GoogleToolkit().get_tools()
 if os.environ.get("ENABLE_MATRIX"):
-    tools += MatrixToolkit().get_tools()
+    tools += MatrixToolkit(llm=llm).get_tools()
 tools += [
     Tool(
         name="wikipedia",
@@ -93,30 +107,43 @@ add_routes(
     graph | RunnableLambda(aaaaaaaaaaaaaa),
 )
 
-if not DEBUG:
-    from apscheduler.schedulers.background import BackgroundScheduler
 
-    scheduler = BackgroundScheduler()
+@app.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
 
-    @scheduler.scheduled_job("interval", id="refresh_token", hours=1)
-    def refresh_token():
-        _LOGGER.info("Refreshing Google user token...")
-        refresh_google_token()
 
-    @scheduler.scheduled_job("interval", id="save_rooms", minutes=15)
-    async def save_rooms():
-        from jarvis.tools.matrix.base import client
+@app.get("/actions")
+def list_action_runs():
+    return action_queue.runs()
 
-        if client:
-            await client.command_save_client()
 
-    scheduler.start()
+@app.get("/macros")
+async def list_macros():
+    return await macro_store.list()
+
 
+@app.post("/macros/{macro_id}/pin")
+async def pin_macro(macro_id: int, pinned: bool = True):
+    if not await macro_store.pin(macro_id, pinned):
+        raise HTTPException(status_code=404, detail="Macro not found")
+    return {"id": macro_id, "pinned": pinned}
 
-def start_matrix() -> Task:
-    from jarvis.tools.matrix.base import main as matrix_main, client as matrix_client
 
-    return asyncio.create_task(matrix_main(matrix_client))
+@app.delete("/macros/{macro_id}")
+async def delete_macro(macro_id: int):
+    if not await macro_store.delete(macro_id):
+        raise HTTPException(status_code=404, detail="Macro not found")
+    return {"id": macro_id, "deleted": True}
+
+def start_scheduler():
+    if not DEBUG:
+        add_periodic_job("sync_calendar", calendar_mirror.sync, minutes=5)
+        add_periodic_job("sync_tasks", tasks_mirror.sync, minutes=5)
+        add_periodic_job("sync_gmail", gmail_index.sync, minutes=2)
+        beancount_ledger.schedule_pending_push()
+    # Also runs scheduled actions, catching up on the ones missed while down
+    scheduler.start()
 
 
 def start_uvicorn() -> Task:
@@ -130,10 +157,12 @@ def start_uvicorn() -> Task:
 # https://stackoverflow.com/questions/76142431/how-to-run-another-application-within-the-same-running-event-loop
 # https://jacobpadilla.com/articles/handling-asyncio-tasks
 async def main():
-    tasks = [
-        *([start_matrix()] if not DEBUG else []),
-        start_uvicorn(),
-    ]
+    await action_queue.start(graph, llm, tools)
+    start_scheduler()
+    if not DEBUG:
+        # Matrix gets its own loop and thread, so syncs don't delay requests
+        matrix_service.start()
+    tasks = [start_uvicorn()]
 
     _done, _pending = await asyncio.wait(tasks, return_when=asyncio.ALL_COMPLETED)
 
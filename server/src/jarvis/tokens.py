@@ -0,0 +1,26 @@
+import logging
+from functools import lru_cache
+from typing import Any, Optional
+
+_LOGGER = logging.getLogger(__name__)
+
+ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> Optional[Any]:
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(ENCODING)
+    except Exception as e:
+        # tiktoken downloads its BPE files on first use, which can fail offline
+        _LOGGER.warning(f"Can't load {ENCODING}, estimating tokens instead: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
@@ -3,11 +3,8 @@ from typing import Type, Optional
 from pydantic import BaseModel, Field
 from langchain_core.tools import BaseTool
 from datetime import datetime
-import os
-from github import Github
-from github.ContentFile import ContentFile
-from github.InputGitTreeElement import InputGitTreeElement
-from github.Auth import Token
+
+from jarvis.tools.beancount_ledger import beancount_ledger
 
 
 _LOGGER = logging.getLogger(__name__)
@@ -39,43 +36,12 @@ class BeancountAddTransactionTool(BaseTool):
         account_to: str,
         amount: float,
     ) -> str:
-        try:
-            github = Github(auth=Token(os.environ["GITHUB_API_KEY_JARVIS"]))
-
-            repo = github.get_repo("comigor/beancount")
-            file_path = "beancount/2024.beancount"
-
-            # Get a reference to the desired branch
-            head_ref = repo.get_git_ref("heads/master")
-
-            # Get the commit object on the branch tip (HEAD)
-            commit = repo.get_git_commit(head_ref.object.sha)
-
-            # Get the file content from the commit using the Get Contents API
-            file_content = repo.get_contents(path=file_path, ref=commit.sha)
-            if isinstance(file_content, ContentFile):
-                file_content = file_content.decoded_content.decode()
-
-            # Create a new blob object with the edited content
-            blob = repo.create_git_blob(
-                f"""{file_content}
-{date.strftime("%Y-%m-%d")} * "{payee}" "{comment}"
+        entry = f"""{date.strftime("%Y-%m-%d")} * "{payee}" "{comment}"
   {account_to} {"{:.2f}".format(amount)} BRL
   {account_from}
-""",
-                "utf-8",
-            )
-
-            # Create a new tree object with the updated file
-            tree = repo.create_git_tree(
-                [InputGitTreeElement(file_path, type="blob", mode="100644", sha=blob.sha)],
-                base_tree=commit.tree,
-            )
-
-            # Create a new commit object with the updated tree and parent commit
-            new_commit = repo.create_git_commit("From JARVIS", tree=tree, parents=[commit])
-
-            head_ref.edit(sha=new_commit.sha, force=False)
+"""
+        try:
+            beancount_ledger.add(date, entry)
         except Exception as e:
             _LOGGER.error(f"Error: {e}")
             return f"Sorry, I can't do that."
@@ -1,20 +1,133 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Collection, List, Optional
+
 from langchain_community.tools.gmail.utils import get_gmail_credentials
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
+from googleapiclient.discovery import build
+
+from jarvis import metrics
+
+_LOGGER = logging.getLogger(__name__)
 
 GOOGLE_SCOPES = [
     "https://www.googleapis.com/auth/calendar.events",
     "https://www.googleapis.com/auth/tasks",
     "https://mail.google.com/",
 ]
+TOKEN_FILE = "token.json"
+# Google caps batch requests at 50 calls for Calendar (and 1000 elsewhere)
+BATCH_SIZE = 50
+BATCH_ATTEMPTS = 3
+BATCH_RETRY_SECONDS = 1
+# Rate limits and server errors, worth sending again
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+
+
+class GoogleClientManager:
+    """Keeps Google credentials in memory, refreshing them shortly before they
+    expire, and caches API service objects. httplib2 (used by the service
+    objects) is not thread-safe, so services are cached per thread."""
+
+    def __init__(
+        self,
+        scopes: list[str],
+        token_file: str = TOKEN_FILE,
+        refresh_margin: timedelta = timedelta(minutes=5),
+    ):
+        self.scopes = scopes
+        self.token_file = token_file
+        self.refresh_margin = refresh_margin
+        self._credentials: Optional[Credentials] = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def credentials(self) -> Credentials:
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = get_gmail_credentials(
+                    token_file=self.token_file, scopes=self.scopes
+                )
+            creds = self._credentials
+            # google-auth keeps expiry as a naive UTC datetime
+            expiring = creds.expiry is not None and (
+                creds.expiry - datetime.now(timezone.utc).replace(tzinfo=None)
+                < self.refresh_margin
+            )
+            if (expiring or not creds.valid) and creds.refresh_token:
+                _LOGGER.info("Refreshing Google user token...")
+                creds.refresh(Request())
+                with open(self.token_file, "w") as token:
+                    token.write(creds.to_json())
+            return creds
+
+    def service(self, api: str, version: str) -> Any:
+        credentials = self.credentials()
+        services = self._local.__dict__.setdefault("services", {})
+        key = (api, version)
+        if key not in services:
+            # Use the discovery documents bundled with googleapiclient instead of
+            # fetching (and parsing) them from the network on every build.
+            services[key] = build(
+                api,
+                version,
+                credentials=credentials,
+                static_discovery=True,
+                cache_discovery=False,
+            )
+        return services[key]
+
+
+google_clients = GoogleClientManager(GOOGLE_SCOPES)
+
+
+class BatchError(str):
+    """Error message of a batch call, with its HTTP status when there's one."""
+
+    status: Optional[int] = None
+
+
+def execute_batch(
+    service: Any,
+    requests: List[Any],
+    retry_statuses: Collection[int] = (),
+) -> List[tuple[Any, Optional[BatchError]]]:
+    """Sends `requests` through the batch endpoint (one HTTP round-trip per
+    BATCH_SIZE calls) and returns a (response, error) pair for each of them.
+    Calls failing with one of `retry_statuses` are sent again in a new batch,
+    with backoff, up to BATCH_ATTEMPTS times; only pass them for reads."""
+    results: List[tuple[Any, Optional[BatchError]]] = [(None, None)] * len(requests)
+    retry: List[int] = []
 
+    def callback(request_id: str, response: Any, exception: Optional[Exception]):
+        error = None
+        if exception is not None:
+            error = BatchError(getattr(exception, "reason", None) or str(exception))
+            status = getattr(getattr(exception, "resp", None), "status", None)
+            error.status = int(status) if status is not None else None
+            if error.status in retry_statuses:
+                retry.append(int(request_id))
+        results[int(request_id)] = (response, error)
 
-def authenticate_with_google():
-    return get_gmail_credentials(scopes=GOOGLE_SCOPES)
+    pending = list(range(len(requests)))
+    for attempt in range(BATCH_ATTEMPTS):
+        for offset in range(0, len(pending), BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=callback)
+            for i in pending[offset : offset + BATCH_SIZE]:
+                batch.add(requests[i], request_id=str(i))
+            batch.execute()
+        if not retry or attempt == BATCH_ATTEMPTS - 1:
+            break
+        _LOGGER.info(f"Retrying {len(retry)} failed batch calls")
+        metrics.increment("google.batch_retries", len(retry))
+        pending = sorted(retry)
+        retry.clear()
+        time.sleep(BATCH_RETRY_SECONDS * 2**attempt)
+    return results
 
 
-def refresh_google_token():
-    creds = Credentials.from_authorized_user_file("token.json", GOOGLE_SCOPES)
-    creds.refresh(Request())
-    with open("token.json", "w") as token:
-        token.write(creds.to_json())
+def authenticate_with_google() -> Credentials:
+    return google_clients.credentials()
@@ -1,11 +1,11 @@
-import json
-from typing import Type, Any, Optional
+from typing import Type, Any, List, Optional
 from datetime import datetime, timezone
 from pydantic import BaseModel, Field
-from googleapiclient.discovery import build
 from langchain.tools import BaseTool
 
-from jarvis.tools.google.base import authenticate_with_google
+from jarvis.tools.google.base import execute_batch, google_clients
+from jarvis.tools.google.calendar_mirror import calendar_mirror
+from jarvis.tools.google.fields import EVENT_FIELDS, compact_json, paginate
 
 
 class ListEventsSchema(BaseModel):
@@ -26,32 +26,32 @@ class ListEventsTool(BaseTool):
         super().__init__(**kwds)
 
     def _run(self, from_datetime: datetime, to_datetime: datetime) -> str:
-        creds = authenticate_with_google()
+        if calendar_mirror.ready:
+            events = calendar_mirror.list_events(from_datetime, to_datetime)
+            # The mirror keeps whole events
+            return compact_json(self.name, events, EVENT_FIELDS, unmasked=True)
 
-        # Build the Google Calendar API service
-        service = build("calendar", "v3", credentials=creds)
+        # The local mirror isn't synced yet, so ask the API (all pages)
+        service = google_clients.service("calendar", "v3")
 
         # Format the datetime objects to RFC3339
         from_datetime_str = from_datetime.astimezone(timezone.utc).isoformat()
         to_datetime_str = to_datetime.astimezone(timezone.utc).isoformat()
 
         # Get events for the specified time range
-        events_result = (
-            service.events()
-            .list(
+        events = list(
+            paginate(
+                service.events(),
+                EVENT_FIELDS,
                 calendarId="primary",
                 timeMin=from_datetime_str,
                 timeMax=to_datetime_str,
-                maxResults=10,  # You can adjust the number of results as needed
                 singleEvents=True,
                 orderBy="startTime",
             )
-            .execute()
         )
 
-        events = events_result.get("items", [])
-
-        return json.dumps(events)
+        return compact_json(self.name, events, EVENT_FIELDS)
 
 
 class CreateEventSchema(BaseModel):
@@ -67,6 +67,32 @@ class CreateEventSchema(BaseModel):
     )
 
 
+def _event_body(
+    summary: str,
+    start_datetime: datetime,
+    end_datetime: datetime,
+    location: Optional[str] = None,
+) -> dict[str, Any]:
+    # Format the datetime objects to RFC3339
+    start_datetime_str = start_datetime.astimezone(timezone.utc).isoformat()
+    end_datetime_str = end_datetime.astimezone(timezone.utc).isoformat()
+
+    return {
+        "summary": summary,
+        "start": {"dateTime": start_datetime_str, "timeZone": "UTC"},
+        "end": {"dateTime": end_datetime_str, "timeZone": "UTC"},
+        **({"location": location} if location is not None else {}),
+    }
+
+
+def _apply_to_mirror(created_events: List[dict[str, Any]]):
+    # Keep the local mirror coherent right away, then catch up with the API
+    if calendar_mirror.ready:
+        for created_event in created_events:
+            calendar_mirror.apply(created_event)
+    calendar_mirror.sync_in_background()
+
+
 class CreateEventTool(BaseTool):
     name: str = "create_google_calendar_event_tool"
     description: str = "Create an event on Google Calendar"
@@ -82,26 +108,59 @@ class CreateEventTool(BaseTool):
         end_datetime: datetime,
         location: Optional[str] = None,
     ) -> str:
-        creds = authenticate_with_google()
-
-        # Build the Google Calendar API service
-        service = build("calendar", "v3", credentials=creds)
-
-        # Format the datetime objects to RFC3339
-        start_datetime_str = start_datetime.astimezone(timezone.utc).isoformat()
-        end_datetime_str = end_datetime.astimezone(timezone.utc).isoformat()
-
-        # Create the event body
-        event_body = {
-            "summary": summary,
-            "start": {"dateTime": start_datetime_str, "timeZone": "UTC"},
-            "end": {"dateTime": end_datetime_str, "timeZone": "UTC"},
-            **({"location": location} if location is not None else {}),
-        }
+        service = google_clients.service("calendar", "v3")
+        event_body = _event_body(summary, start_datetime, end_datetime, location)
 
         # Insert the event
         created_event = (
             service.events().insert(calendarId="primary", body=event_body).execute()
         )
+        _apply_to_mirror([created_event])
+
+        return compact_json(self.name, created_event, EVENT_FIELDS, unmasked=True)
 
-        return json.dumps(created_event)
+
+class CreateEventsSchema(BaseModel):
+    events: List[CreateEventSchema] = Field(
+        description="Events to create, all at once. Required."
+    )
+
+
+class CreateEventsTool(BaseTool):
+    name: str = "create_google_calendar_events_tool"
+    description: str = "Create several events on Google Calendar at once (e.g. recurring blocks on different days). Prefer it over multiple calls to create_google_calendar_event_tool."
+    args_schema: Type[BaseModel] = CreateEventsSchema
+
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+    def _run(self, events: List[CreateEventSchema | dict[str, Any]]) -> str:
+        service = google_clients.service("calendar", "v3")
+        events = [CreateEventSchema.model_validate(event) for event in events]
+
+        results = execute_batch(
+            service,
+            [
+                service.events().insert(
+                    calendarId="primary",
+                    body=_event_body(
+                        event.summary,
+                        event.start_datetime,
+                        event.end_datetime,
+                        event.location,
+                    ),
+                )
+                for event in events
+            ],
+        )
+        _apply_to_mirror([created for created, error in results if error is None])
+
+        return compact_json(
+            self.name,
+            [
+                {"created": created} if error is None else {"summary": event.summary, "error": error}
+                for event, (created, error) in zip(events, results)
+            ],
+            f"summary,error,created({EVENT_FIELDS})",
+            unmasked=True,
+        )
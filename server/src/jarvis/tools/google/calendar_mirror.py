@@ -0,0 +1,212 @@
+import bisect
+import logging
+import threading
+from datetime import date, datetime, time, timezone
+from typing import Any, List, Optional
+from zoneinfo import ZoneInfo
+
+from googleapiclient.errors import HttpError
+
+from jarvis.scheduler import run_soon
+from jarvis.tools.google.base import google_clients
+from jarvis.tools.google.fields import EVENT_FIELDS, paginate
+from jarvis.tools.google.recurrence import UnsupportedRecurrence, occurrences
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TIMEZONE = "America/Sao_Paulo"
+
+
+def _event_time(value: dict[str, str], tz: ZoneInfo) -> datetime:
+    if "dateTime" in value:
+        return datetime.fromisoformat(value["dateTime"])
+    return datetime.combine(date.fromisoformat(value["date"]), time(), tz)
+
+
+def _instance_key(moment: datetime) -> int:
+    return int(moment.timestamp())
+
+
+class CalendarMirror:
+    """Local copy of a Google Calendar kept current with incremental `syncToken`
+    syncs. Single events (and modified instances of recurring ones) are indexed
+    by start time; recurring events are expanded locally when queried."""
+
+    def __init__(self, calendar_id: str = "primary"):
+        self.calendar_id = calendar_id
+        self.timezone = ZoneInfo(DEFAULT_TIMEZONE)
+        self.sync_token: Optional[str] = None
+        self.ready = False
+        self._singles: dict[str, dict[str, Any]] = {}
+        self._masters: dict[str, dict[str, Any]] = {}
+        # recurringEventId -> original start -> instance (modified or cancelled)
+        self._exceptions: dict[str, dict[int, dict[str, Any]]] = {}
+        self._index: List[tuple[float, float, str]] = []
+        self._max_duration = 0.0
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+
+    def sync(self) -> None:
+        with self._sync_lock:
+            try:
+                self._sync(self.sync_token)
+            except HttpError as e:
+                # 410 Gone means the sync token expired, a full sync is required
+                if e.resp.status != 410:
+                    raise
+                _LOGGER.info("Calendar sync token expired, running a full sync")
+                self._sync(None)
+
+    def sync_in_background(self) -> None:
+        # Brings the periodic sync forward, so both never run at once
+        run_soon("sync_calendar", self.sync)
+
+    def _sync(self, sync_token: Optional[str]) -> None:
+        service = google_clients.service("calendar", "v3")
+        events = service.events()
+        request = events.list(
+            calendarId=self.calendar_id,
+            singleEvents=False,
+            maxResults=2500,
+            **({"syncToken": sync_token} if sync_token else {}),
+        )
+        changes: List[dict[str, Any]] = []
+        next_sync_token = None
+        while request is not None:
+            response = request.execute()
+            changes += response.get("items", [])
+            if response.get("timeZone"):
+                self.timezone = ZoneInfo(response["timeZone"])
+            next_sync_token = response.get("nextSyncToken", next_sync_token)
+            request = events.list_next(request, response)
+
+        with self._lock:
+            if sync_token is None:
+                self._singles, self._masters, self._exceptions = {}, {}, {}
+            for event in changes:
+                self._apply(event)
+            self._reindex()
+            self.sync_token = next_sync_token
+            self.ready = True
+        _LOGGER.debug(f"Calendar synced, {len(changes)} changes")
+
+    def apply(self, event: dict[str, Any]) -> None:
+        """Applies a single event we already know about (e.g. one we just created)."""
+        with self._lock:
+            self._apply(event)
+            self._reindex()
+
+    def _apply(self, event: dict[str, Any]) -> None:
+        event_id = event["id"]
+        master_id = event.get("recurringEventId")
+        if master_id:
+            original = _event_time(event["originalStartTime"], self.timezone)
+            self._exceptions.setdefault(master_id, {})[_instance_key(original)] = event
+            if event.get("status") == "cancelled":
+                self._singles.pop(event_id, None)
+            else:
+                self._singles[event_id] = event
+        elif event.get("status") == "cancelled":
+            self._singles.pop(event_id, None)
+            self._masters.pop(event_id, None)
+            for exception in self._exceptions.pop(event_id, {}).values():
+                self._singles.pop(exception["id"], None)
+        elif event.get("recurrence"):
+            self._masters[event_id] = event
+            self._singles.pop(event_id, None)
+        else:
+            self._singles[event_id] = event
+            self._masters.pop(event_id, None)
+
+    def _reindex(self) -> None:
+        index = []
+        max_duration = 0.0
+        for master in self._masters.values():
+            start = _event_time(master["start"], self.timezone).timestamp()
+            end = _event_time(master["end"], self.timezone).timestamp()
+            max_duration = max(max_duration, end - start)
+        for event_id, event in self._singles.items():
+            start = _event_time(event["start"], self.timezone).timestamp()
+            end = _event_time(event["end"], self.timezone).timestamp()
+            index.append((start, end, event_id))
+            max_duration = max(max_duration, end - start)
+        index.sort()
+        self._index = index
+        self._max_duration = max_duration
+
+    def _expand(
+        self, master: dict[str, Any], from_datetime: datetime, to_datetime: datetime
+    ) -> List[dict[str, Any]]:
+        tz = ZoneInfo(master["start"].get("timeZone") or str(self.timezone))
+        all_day = "date" in master["start"]
+        dtstart = _event_time(master["start"], tz).astimezone(tz)
+        duration = _event_time(master["end"], tz) - _event_time(master["start"], tz)
+        exceptions = self._exceptions.get(master["id"], {})
+        template = {
+            k: v
+            for k, v in master.items()
+            if k not in ("id", "start", "end", "recurrence")
+        }
+
+        instances = []
+        try:
+            for moment in occurrences(dtstart, master["recurrence"], to_datetime):
+                if moment + duration <= from_datetime or _instance_key(moment) in exceptions:
+                    continue
+                if all_day:
+                    start = {"date": moment.date().isoformat()}
+                    end = {"date": (moment + duration).date().isoformat()}
+                    suffix = moment.strftime("%Y%m%d")
+                else:
+                    start = {"dateTime": moment.isoformat(), "timeZone": str(tz)}
+                    end = {"dateTime": (moment + duration).isoformat(), "timeZone": str(tz)}
+                    suffix = moment.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+                instances.append(
+                    {
+                        **template,
+                        "id": f"{master['id']}_{suffix}",
+                        "recurringEventId": master["id"],
+                        "originalStartTime": start,
+                        "start": start,
+                        "end": end,
+                    }
+                )
+        except UnsupportedRecurrence as e:
+            _LOGGER.info(f"Expanding {master['id']} remotely ({e})")
+            instances = list(
+                paginate(
+                    google_clients.service("calendar", "v3").events(),
+                    EVENT_FIELDS,
+                    method="instances",
+                    calendarId=self.calendar_id,
+                    eventId=master["id"],
+                    timeMin=from_datetime.astimezone(timezone.utc).isoformat(),
+                    timeMax=to_datetime.astimezone(timezone.utc).isoformat(),
+                )
+            )
+        return instances
+
+    def list_events(
+        self, from_datetime: datetime, to_datetime: datetime
+    ) -> List[dict[str, Any]]:
+        with self._lock:
+            start = from_datetime.timestamp()
+            end = to_datetime.timestamp()
+            lo = bisect.bisect_left(self._index, (start - self._max_duration,))
+            hi = bisect.bisect_left(self._index, (end,))
+            events = [
+                self._singles[event_id]
+                for event_start, event_end, event_id in self._index[lo:hi]
+                if event_end > start
+            ]
+            masters = list(self._masters.values())
+
+        for master in masters:
+            events += self._expand(master, from_datetime, to_datetime)
+
+        return sorted(
+            events, key=lambda e: _event_time(e["start"], self.timezone).timestamp()
+        )
+
+
+calendar_mirror = CalendarMirror()
@@ -0,0 +1,77 @@
+import json
+from functools import lru_cache
+from typing import Any, Iterator
+
+from jarvis import metrics
+from jarvis.tokens import count_tokens
+
+# Partial-response masks (https://developers.google.com/gdata/docs/2.0/basics#PartialResponse)
+# sent as `fields=` and also used to project resources we already hold in full
+EVENT_FIELDS = "id,status,summary,location,start(date,dateTime),end(date,dateTime),recurringEventId"
+TASK_FIELDS = "id,title,notes,status,due,completed"
+
+FieldTree = dict[str, "FieldTree"]
+
+
+@lru_cache(maxsize=32)
+def parse_mask(mask: str) -> FieldTree:
+    """Parses "a,b(c,d)" into {"a": {}, "b": {"c": {}, "d": {}}}."""
+    tree: FieldTree = {}
+    stack = [tree]
+    name = ""
+    for char in mask + ",":
+        if char in ",()" and name.strip():
+            stack[-1][name.strip()] = {}
+        if char == "(":
+            stack.append(stack[-1][name.strip()])
+        elif char == ")":
+            stack.pop()
+        if char in ",()":
+            name = ""
+        else:
+            name += char
+    return tree
+
+
+def project(resource: Any, mask: str | FieldTree) -> Any:
+    """Keeps only the fields in `mask`, dropping empty ones."""
+    tree = parse_mask(mask) if isinstance(mask, str) else mask
+    if isinstance(resource, list):
+        return [project(item, tree) for item in resource]
+    if not isinstance(resource, dict) or not tree:
+        return resource
+    return {
+        key: project(resource[key], subtree)
+        for key, subtree in tree.items()
+        if resource.get(key) not in (None, "", [], {})
+    }
+
+
+def paginate(
+    collection: Any, mask: str, items_key: str = "items", method: str = "list", **kwargs
+) -> Iterator[dict[str, Any]]:
+    """Yields every item of a `list` call (or another paged `method`, e.g.
+    `instances`), one page at a time, asking only for the fields in `mask`."""
+    request = getattr(collection, method)(fields=f"nextPageToken,{items_key}({mask})", **kwargs)
+    while request is not None:
+        response = request.execute()
+        yield from response.get(items_key, [])
+        request = getattr(collection, f"{method}_next")(request, response)
+
+
+def compact_json(tool_name: str, received: Any, mask: str, unmasked: bool = False) -> str:
+    """Projects `received` to `mask` and serializes it compactly for the LLM,
+    recording its size. When `received` is the unmasked resource (e.g. from a
+    mirror or an insert), also records the bytes and tokens the mask saved;
+    responses already fetched with the mask are no baseline for that."""
+    output = json.dumps(project(received, mask), separators=(",", ":"), ensure_ascii=False)
+    output_bytes = len(output.encode())
+    output_tokens = count_tokens(output)
+    metrics.observe(f"google.{tool_name}.output_bytes", output_bytes)
+    metrics.observe(f"google.{tool_name}.output_tokens", output_tokens)
+    if unmasked:
+        # What the LLM would get without the mask
+        full = json.dumps(received, ensure_ascii=False)
+        metrics.observe(f"google.{tool_name}.bytes_saved", len(full.encode()) - output_bytes)
+        metrics.observe(f"google.{tool_name}.tokens_saved", count_tokens(full) - output_tokens)
+    return output
@@ -0,0 +1,342 @@
+import base64
+import logging
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from email.utils import parseaddr
+from typing import Any, List, Optional, Type
+
+from bs4 import BeautifulSoup
+from googleapiclient.errors import HttpError
+from langchain.tools import BaseTool
+from pydantic import BaseModel, Field
+
+from jarvis import metrics
+from jarvis.tools.google.base import TRANSIENT_STATUSES, execute_batch, google_clients
+from jarvis.tools.google.fields import compact_json, paginate
+
+_LOGGER = logging.getLogger(__name__)
+
+GMAIL_INDEX_DAYS = int(os.environ.get("GMAIL_INDEX_DAYS", 14))
+METADATA_FIELDS = "id,threadId,labelIds,snippet,internalDate,historyId,payload/headers"
+HEADERS = ["From", "To", "Subject"]
+DIGEST_FIELDS = "id,from,subject,date,snippet,unread"
+MAX_BODY_CHARS = 4000
+BODY_CACHE_SIZE = 32
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _summary(message: dict[str, Any]) -> dict[str, Any]:
+    headers = {
+        h["name"]: h["value"] for h in message.get("payload", {}).get("headers", [])
+    }
+    name, address = parseaddr(headers.get("From", ""))
+    received = datetime.fromtimestamp(int(message["internalDate"]) / 1000, timezone.utc)
+    return {
+        "id": message["id"],
+        "threadId": message.get("threadId"),
+        "from": f"{name} <{address}>" if name else address,
+        "to": headers.get("To"),
+        "subject": headers.get("Subject", ""),
+        "date": received.isoformat(),
+        "timestamp": received.timestamp(),
+        "snippet": message.get("snippet", ""),
+        "labelIds": message.get("labelIds", []),
+        "unread": "UNREAD" in message.get("labelIds", []),
+    }
+
+
+def _body_text(payload: dict[str, Any]) -> str:
+    """Returns the text/plain part of a message, or the text of its text/html part."""
+    parts = [payload]
+    html = None
+    while parts:
+        part = parts.pop(0)
+        parts += part.get("parts", [])
+        data = part.get("body", {}).get("data")
+        if not data:
+            continue
+        text = base64.urlsafe_b64decode(data).decode("utf-8", errors="replace")
+        if part.get("mimeType") == "text/plain":
+            return text
+        if part.get("mimeType") == "text/html" and html is None:
+            html = text
+    if html is None:
+        return ""
+    return BeautifulSoup(html, "html.parser").get_text(" ", strip=True)
+
+
+class GmailIndex:
+    """Headers and snippets of recent inbox messages. It's filled once from a
+    `newer_than:` search and then kept current with `history.list` from the
+    last seen `historyId`, so questions never scan the mailbox. Bodies are only
+    fetched when a message is read."""
+
+    def __init__(self, days: int = GMAIL_INDEX_DAYS):
+        self.days = days
+        self.history_id: Optional[str] = None
+        self.ready = False
+        self._messages: dict[str, dict[str, Any]] = {}
+        self._bodies: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+
+    def sync(self) -> None:
+        with self._sync_lock:
+            try:
+                if self.history_id is None:
+                    self._full_sync()
+                else:
+                    self._incremental_sync()
+            except HttpError as e:
+                # 404 means the history id is too old, a full sync is required
+                if e.resp.status != 404:
+                    raise
+                _LOGGER.info("Gmail history id expired, running a full sync")
+                self._full_sync()
+            self._prune()
+
+    def _fetch(self, service: Any, message_ids: List[str]) -> tuple[List[dict[str, Any]], int]:
+        """The messages, and how many couldn't be fetched. Messages deleted
+        meanwhile (404) aren't failures, they're just gone."""
+        results = execute_batch(
+            service,
+            [
+                service.users()
+                .messages()
+                .get(
+                    userId="me",
+                    id=message_id,
+                    format="metadata",
+                    metadataHeaders=HEADERS,
+                    fields=METADATA_FIELDS,
+                )
+                for message_id in message_ids
+            ],
+            retry_statuses=TRANSIENT_STATUSES,
+        )
+        messages = [message for message, error in results if error is None]
+        failed = [
+            message_id
+            for message_id, (_, error) in zip(message_ids, results)
+            if error is not None and error.status != 404
+        ]
+        if failed:
+            _LOGGER.warning(f"Couldn't fetch {len(failed)} Gmail messages, e.g. {failed[0]}")
+            metrics.increment("gmail.fetch_failures", len(failed))
+        return messages, len(failed)
+
+    def _full_sync(self) -> None:
+        service = google_clients.service("gmail", "v1")
+        # Read the history id first, so nothing that arrives meanwhile is lost
+        history_id = service.users().getProfile(userId="me").execute()["historyId"]
+        message_ids = [
+            message["id"]
+            for message in paginate(
+                service.users().messages(),
+                "id",
+                items_key="messages",
+                userId="me",
+                q=f"in:inbox newer_than:{self.days}d",
+                maxResults=500,
+            )
+        ]
+        messages, failed = self._fetch(service, message_ids)
+        with self._lock:
+            self._messages = {m["id"]: _summary(m) for m in messages}
+            # Without a history id the next sync is a full one again
+            self.history_id = history_id if not failed else None
+            self.ready = True
+        _LOGGER.debug(f"Gmail indexed, {len(messages)} messages")
+
+    def _incremental_sync(self) -> None:
+        service = google_clients.service("gmail", "v1")
+        history = service.users().history()
+        request = history.list(
+            userId="me",
+            startHistoryId=self.history_id,
+            maxResults=500,
+        )
+        history_id = self.history_id
+        added: List[str] = []
+        deleted: set[str] = set()
+        labels: dict[str, List[str]] = {}
+        while request is not None:
+            response = request.execute()
+            history_id = response.get("historyId", history_id)
+            for record in response.get("history", []):
+                for item in record.get("messagesAdded", []):
+                    added.append(item["message"]["id"])
+                for item in record.get("messagesDeleted", []):
+                    deleted.add(item["message"]["id"])
+                for item in record.get("labelsAdded", []) + record.get("labelsRemoved", []):
+                    labels[item["message"]["id"]] = item["message"].get("labelIds", [])
+            request = history.list_next(request, response)
+
+        with self._lock:
+            # Messages moved back to the inbox aren't indexed yet
+            added += [
+                message_id
+                for message_id, label_ids in labels.items()
+                if "INBOX" in label_ids and message_id not in self._messages
+            ]
+        messages, failed = self._fetch(
+            service, [i for i in dict.fromkeys(added) if i not in deleted]
+        )
+        with self._lock:
+            for message_id, label_ids in labels.items():
+                if message_id in self._messages:
+                    self._messages[message_id].update(
+                        labelIds=label_ids, unread="UNREAD" in label_ids
+                    )
+            # Fetched messages carry their current labels
+            for message in messages:
+                if "INBOX" in message.get("labelIds", []):
+                    self._messages[message["id"]] = _summary(message)
+            for message_id in deleted:
+                self._messages.pop(message_id, None)
+            # Archived messages leave the inbox
+            for message_id, message in list(self._messages.items()):
+                if "INBOX" not in message["labelIds"]:
+                    del self._messages[message_id]
+            # Replaying the same history next time picks up the failed ones
+            if not failed:
+                self.history_id = history_id
+        _LOGGER.debug(f"Gmail synced, {len(messages)} new messages")
+
+    def _prune(self) -> None:
+        oldest = (datetime.now(timezone.utc) - timedelta(days=self.days)).timestamp()
+        with self._lock:
+            for message_id, message in list(self._messages.items()):
+                if message["timestamp"] < oldest:
+                    del self._messages[message_id]
+
+    def search(
+        self,
+        from_datetime: Optional[datetime] = None,
+        to_datetime: Optional[datetime] = None,
+        sender: Optional[str] = None,
+        text: Optional[str] = None,
+        unread_only: bool = False,
+        limit: int = 20,
+    ) -> List[dict[str, Any]]:
+        with self._lock:
+            messages = list(self._messages.values())
+        if from_datetime:
+            messages = [m for m in messages if m["timestamp"] >= from_datetime.timestamp()]
+        if to_datetime:
+            messages = [m for m in messages if m["timestamp"] <= to_datetime.timestamp()]
+        if unread_only:
+            messages = [m for m in messages if m["unread"]]
+        if sender:
+            wanted = _normalize(sender)
+            messages = [m for m in messages if wanted in _normalize(m["from"])]
+        if text:
+            wanted = _normalize(text)
+            messages = [
+                m
+                for m in messages
+                if wanted in _normalize(f"{m['subject']} {m['snippet']} {m['from']}")
+            ]
+        return sorted(messages, key=lambda m: m["timestamp"], reverse=True)[:limit]
+
+    def body(self, message_id: str) -> str:
+        with self._lock:
+            if message_id in self._bodies:
+                self._bodies.move_to_end(message_id)
+                return self._bodies[message_id]
+
+        message = (
+            google_clients.service("gmail", "v1")
+            .users()
+            .messages()
+            .get(userId="me", id=message_id, format="full", fields="payload")
+            .execute()
+        )
+        body = _body_text(message["payload"])[:MAX_BODY_CHARS]
+        with self._lock:
+            self._bodies[message_id] = body
+            while len(self._bodies) > BODY_CACHE_SIZE:
+                self._bodies.popitem(last=False)
+        return body
+
+
+gmail_index = GmailIndex()
+
+
+class GmailDigestSchema(BaseModel):
+    from_datetime: Optional[datetime] = Field(
+        None,
+        description="Only emails received after this timestamp (RFC3339 timestamp with mandatory time zone offset, e.g., 2011-06-03T10:00:00-07:00). Optional.",
+    )
+    to_datetime: Optional[datetime] = Field(
+        None,
+        description="Only emails received before this timestamp (RFC3339 timestamp with mandatory time zone offset, e.g., 2011-06-03T10:00:00-07:00). Optional.",
+    )
+    sender: Optional[str] = Field(
+        None, description="Part of the sender name or address (e.g. 'itau'). Optional."
+    )
+    text: Optional[str] = Field(
+        None, description="Text to look for in the subject or snippet. Optional."
+    )
+    unread_only: Optional[bool] = Field(
+        False, description="Whether to show only unread emails. Optional."
+    )
+    max_results: Optional[int] = Field(
+        20, description="Maximum number of emails to return. Optional."
+    )
+
+
+class GmailDigestTool(BaseTool):
+    name: str = "gmail_digest"
+    description: str = f"Lists recent inbox emails (last {GMAIL_INDEX_DAYS} days) with sender, subject and a snippet. Use gmail_read_message to read the whole email."
+    args_schema: Type[BaseModel] = GmailDigestSchema
+
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+    def _run(
+        self,
+        from_datetime: Optional[datetime] = None,
+        to_datetime: Optional[datetime] = None,
+        sender: Optional[str] = None,
+        text: Optional[str] = None,
+        unread_only: Optional[bool] = False,
+        max_results: Optional[int] = 20,
+    ) -> str:
+        if not gmail_index.ready:
+            gmail_index.sync()
+        messages = gmail_index.search(
+            from_datetime,
+            to_datetime,
+            sender=sender,
+            text=text,
+            unread_only=bool(unread_only),
+            limit=max_results or 20,
+        )
+        return compact_json(self.name, messages, DIGEST_FIELDS)
+
+
+class GmailReadMessageSchema(BaseModel):
+    message_id: str = Field(description="Id of the email, from gmail_digest. Required.")
+
+
+class GmailReadMessageTool(BaseTool):
+    name: str = "gmail_read_message"
+    description: str = "Reads the text of an email"
+    args_schema: Type[BaseModel] = GmailReadMessageSchema
+
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+    def _run(self, message_id: str) -> str:
+        try:
+            return gmail_index.body(message_id)
+        except HttpError as e:
+            return f"Sorry, I can't do that ({e.reason})"
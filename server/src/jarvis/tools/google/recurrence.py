@@ -0,0 +1,160 @@
+import calendar
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+from typing import Iterator, List, Optional
+from zoneinfo import ZoneInfo
+
+WEEKDAYS = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+SUPPORTED_PARTS = {"FREQ", "INTERVAL", "COUNT", "UNTIL", "BYDAY", "BYMONTHDAY", "BYMONTH", "WKST"}
+MAX_PERIODS = 100_000
+
+
+class UnsupportedRecurrence(Exception): ...
+
+
+def parse_ical_datetime(value: str, tz: tzinfo) -> datetime:
+    """Parses iCalendar DATE / DATE-TIME values (20240105, 20240105T100000,
+    20240105T130000Z) into aware datetimes."""
+    if "T" not in value:
+        return datetime.combine(datetime.strptime(value, "%Y%m%d").date(), time(), tz)
+    if value.endswith("Z"):
+        return datetime.strptime(value, "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+    return datetime.strptime(value, "%Y%m%dT%H%M%S").replace(tzinfo=tz)
+
+
+def _parse_byday(value: str) -> List[tuple[Optional[int], int]]:
+    days = []
+    for part in value.split(","):
+        ordinal = part[:-2]
+        days.append((int(ordinal) if ordinal else None, WEEKDAYS.index(part[-2:])))
+    return days
+
+
+def _month_dates(year: int, month: int, rule: dict[str, str], dtstart: datetime) -> List[date]:
+    last = calendar.monthrange(year, month)[1]
+    byday = _parse_byday(rule["BYDAY"]) if "BYDAY" in rule else []
+    if "BYMONTHDAY" in rule:
+        days = [int(d) for d in rule["BYMONTHDAY"].split(",")]
+        dates = [date(year, month, d if d > 0 else last + d + 1) for d in days if 1 <= abs(d) <= last]
+        if byday:
+            weekdays = {weekday for _, weekday in byday}
+            dates = [d for d in dates if d.weekday() in weekdays]
+        return sorted(set(dates))
+    if byday:
+        dates = []
+        for ordinal, weekday in byday:
+            matches = [
+                date(year, month, d)
+                for d in range(1, last + 1)
+                if date(year, month, d).weekday() == weekday
+            ]
+            if ordinal is None:
+                dates += matches
+            elif 0 < abs(ordinal) <= len(matches):
+                dates.append(matches[ordinal - 1 if ordinal > 0 else ordinal])
+        return sorted(set(dates))
+    return [date(year, month, dtstart.day)] if dtstart.day <= last else []
+
+
+def _period_dates(rule: dict[str, str], dtstart: datetime, period: int) -> Iterator[date]:
+    freq = rule["FREQ"]
+    interval = int(rule.get("INTERVAL", 1))
+    months = [int(m) for m in rule["BYMONTH"].split(",")] if "BYMONTH" in rule else None
+    start = dtstart.date()
+
+    if freq == "DAILY":
+        day = start + timedelta(days=period * interval)
+        weekdays = {w for _, w in _parse_byday(rule["BYDAY"])} if "BYDAY" in rule else None
+        monthdays = {int(d) for d in rule["BYMONTHDAY"].split(",")} if "BYMONTHDAY" in rule else None
+        if (
+            (months is None or day.month in months)
+            and (weekdays is None or day.weekday() in weekdays)
+            and (monthdays is None or day.day in monthdays)
+        ):
+            yield day
+    elif freq == "WEEKLY":
+        wkst = WEEKDAYS.index(rule.get("WKST", "MO"))
+        week = start - timedelta(days=(start.weekday() - wkst) % 7)
+        week += timedelta(weeks=period * interval)
+        weekdays = [w for _, w in _parse_byday(rule["BYDAY"])] if "BYDAY" in rule else [start.weekday()]
+        for day in sorted(week + timedelta(days=(w - wkst) % 7) for w in weekdays):
+            if months is None or day.month in months:
+                yield day
+    elif freq == "MONTHLY":
+        index = start.month - 1 + period * interval
+        year, month = start.year + index // 12, index % 12 + 1
+        if months is None or month in months:
+            yield from _month_dates(year, month, rule, dtstart)
+    elif freq == "YEARLY":
+        if "BYDAY" in rule and months is None:
+            raise UnsupportedRecurrence("YEARLY with BYDAY and no BYMONTH")
+        year = start.year + period * interval
+        for month in months or [start.month]:
+            yield from _month_dates(year, month, rule, dtstart)
+    else:
+        raise UnsupportedRecurrence(f"FREQ={freq}")
+
+
+def _period_floor(rule: dict[str, str], dtstart: datetime, period: int) -> date:
+    """First day a period can possibly cover, to stop on periods without dates."""
+    interval = int(rule.get("INTERVAL", 1))
+    start = dtstart.date()
+    if rule["FREQ"] == "DAILY":
+        return start + timedelta(days=period * interval)
+    if rule["FREQ"] == "WEEKLY":
+        return start + timedelta(weeks=period * interval) - timedelta(days=6)
+    if rule["FREQ"] == "MONTHLY":
+        index = start.month - 1 + period * interval
+        return date(start.year + index // 12, index % 12 + 1, 1)
+    return date(start.year + period * interval, 1, 1)
+
+
+def occurrences(dtstart: datetime, recurrence: List[str], until: datetime) -> Iterator[datetime]:
+    """Expands the RRULE/EXDATE lines of an event starting at `dtstart` (an aware
+    datetime in the event's own time zone) up to `until`. Covers the rules
+    Google Calendar creates; anything else raises UnsupportedRecurrence."""
+    tz = dtstart.tzinfo
+    rule: Optional[dict[str, str]] = None
+    excluded: set[datetime] = set()
+    for line in recurrence:
+        name, _, value = line.partition(":")
+        if name == "RRULE":
+            rule = dict(part.split("=", 1) for part in value.split(";"))
+        elif name.startswith("EXDATE"):
+            params = dict(p.split("=", 1) for p in name.split(";")[1:])
+            ex_tz = tz
+            if "TZID" in params:
+                ex_tz = ZoneInfo(params["TZID"])
+            excluded |= {parse_ical_datetime(v, ex_tz) for v in value.split(",")}  # type: ignore
+        else:
+            raise UnsupportedRecurrence(name)
+
+    if rule is None:
+        yield dtstart
+        return
+    if set(rule) - SUPPORTED_PARTS:
+        raise UnsupportedRecurrence(", ".join(sorted(set(rule) - SUPPORTED_PARTS)))
+
+    count = int(rule["COUNT"]) if "COUNT" in rule else None
+    rule_until = None
+    if "UNTIL" in rule:
+        rule_until = parse_ical_datetime(rule["UNTIL"], tz)  # type: ignore
+        if "T" not in rule["UNTIL"]:
+            rule_until += timedelta(days=1) - timedelta(microseconds=1)
+    end = min(until, rule_until) if rule_until else until
+
+    emitted = 0
+    for period in range(MAX_PERIODS):
+        period_dates = list(_period_dates(rule, dtstart, period))
+        for day in period_dates:
+            moment = datetime.combine(day, dtstart.time(), tz)
+            if moment < dtstart:
+                continue
+            if moment > end:
+                return
+            emitted += 1
+            if moment not in excluded:
+                yield moment
+            if count is not None and emitted >= count:
+                return
+        if datetime.combine(_period_floor(rule, dtstart, period), time(), tz) > end:
+            return
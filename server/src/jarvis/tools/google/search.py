@@ -0,0 +1,213 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Generic, List, Optional, Type, TypeVar
+from urllib.parse import urldefrag
+
+import httpx
+from bs4 import BeautifulSoup
+from langchain.tools import BaseTool
+from pydantic import BaseModel, Field
+
+from jarvis import metrics
+
+_LOGGER = logging.getLogger(__name__)
+
+SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
+SEARCH_TTL = 6 * 60 * 60
+PAGE_TTL = 24 * 60 * 60
+MAX_PAGE_CHARS = 3000
+# Read at most this much of a page, its text is usually well within it
+MAX_PAGE_BYTES = 1024 * 1024
+MAX_FETCHED_PAGES = 3
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[V]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key: str, value: V) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+def normalize_query(query: str) -> str:
+    text = unicodedata.normalize("NFKC", query).casefold()
+    return " ".join(text.replace('"', " ").split())
+
+
+def _normalize_link(link: str) -> str:
+    return urldefrag(link)[0].rstrip("/")
+
+
+def _extract_text(html: str) -> str:
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style", "noscript", "nav", "header", "footer", "aside", "form"]):
+        tag.decompose()
+    root = soup.find("article") or soup.find("main") or soup.body or soup
+    return " ".join(root.get_text(" ", strip=True).split())[:MAX_PAGE_CHARS]
+
+
+class GoogleSearch:
+    """Google Custom Search with normalised queries, cached results and cached
+    page text, running several queries (and page fetches) concurrently."""
+
+    def __init__(self, api_key: str, cse_id: str):
+        self.api_key = api_key
+        self.cse_id = cse_id
+        self.client = httpx.AsyncClient(timeout=20, follow_redirects=True)
+        self.results = TTLCache[List[dict[str, str]]](maxsize=256, ttl=SEARCH_TTL)
+        self.pages = TTLCache[str](maxsize=64, ttl=PAGE_TTL)
+
+    async def search(self, query: str, num: int) -> List[dict[str, str]]:
+        key = f"{num}:{normalize_query(query)}"
+        cached = self.results.get(key)
+        if cached is not None:
+            metrics.increment("google.search.cache_hits")
+            return cached
+
+        metrics.increment("google.search.api_calls")
+        response = await self.client.get(
+            SEARCH_URL,
+            params={"key": self.api_key, "cx": self.cse_id, "q": query, "num": num},
+        )
+        response.raise_for_status()
+        results = [
+            {"title": item.get("title"), "link": item["link"], "snippet": item.get("snippet")}
+            for item in response.json().get("items", [])
+        ]
+        self.results.set(key, results)
+        return results
+
+    async def fetch(self, link: str) -> Optional[str]:
+        """The text of the page, or None if it isn't text (PDFs, images...)."""
+        cached = self.pages.get(link)
+        if cached is not None:
+            metrics.increment("google.search.page_cache_hits")
+            return cached
+
+        metrics.increment("google.search.page_fetches")
+        async with self.client.stream(
+            "GET", link, headers={"User-Agent": "Mozilla/5.0"}
+        ) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+            if not (
+                content_type.startswith("text/")
+                or "html" in content_type
+                or content_type.endswith("json")
+            ):
+                metrics.increment("google.search.pages_skipped")
+                return None
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body += chunk
+                if len(body) >= MAX_PAGE_BYTES:
+                    break
+            # A character cut in half at the limit is replaced
+            content = bytes(body[:MAX_PAGE_BYTES]).decode(
+                response.charset_encoding or "utf-8", errors="replace"
+            )
+        if "html" not in content_type:
+            text = content[:MAX_PAGE_CHARS]
+        else:
+            text = await asyncio.to_thread(_extract_text, content)
+        self.pages.set(link, text)
+        return text
+
+    async def run(
+        self, queries: List[str], num: int = 5, fetch_pages: bool = False
+    ) -> List[dict[str, Any]]:
+        # The same query written twice only hits the API once
+        unique = list({normalize_query(q): q for q in queries}.values())
+        responses = await asyncio.gather(
+            *[self.search(query, num) for query in unique], return_exceptions=True
+        )
+
+        results: List[dict[str, Any]] = []
+        seen: set[str] = set()
+        for query, response in zip(unique, responses):
+            if isinstance(response, BaseException):
+                _LOGGER.warning(f"Search for {query!r} failed: {response}")
+                continue
+            for result in response:
+                link = _normalize_link(result["link"])
+                if link not in seen:
+                    seen.add(link)
+                    results.append({**result, "query": query})
+        if len(unique) > 0 and all(isinstance(r, BaseException) for r in responses):
+            raise responses[0]  # type: ignore
+
+        if fetch_pages:
+            top = results[:MAX_FETCHED_PAGES]
+            pages = await asyncio.gather(
+                *[self.fetch(result["link"]) for result in top], return_exceptions=True
+            )
+            for result, page in zip(top, pages):
+                if isinstance(page, str):
+                    result["content"] = page
+        return results
+
+
+class GoogleSearchInput(BaseModel):
+    queries: List[str] = Field(
+        description="Search queries. Send every variation you want at once, they run in parallel and duplicated results are removed."
+    )
+    fetch_pages: Optional[bool] = Field(
+        False,
+        description=f"Whether to also read the text of the top {MAX_FETCHED_PAGES} results, when snippets aren't enough. Optional.",
+    )
+
+
+class GoogleSearchTool(BaseTool):
+    name: str = "google_search"
+    description: str = "A wrapper around Google Search. Useful for when you need to answer questions about current events. Input should be search queries."
+    args_schema: Type[BaseModel] = GoogleSearchInput
+    search: GoogleSearch
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+    def _run(self, queries: List[str], fetch_pages: Optional[bool] = False) -> str:
+        raise NotImplementedError(
+            "Synchronous execution is not supported for this tool."
+        )
+
+    async def _arun(self, queries: List[str], fetch_pages: Optional[bool] = False) -> str:
+        try:
+            results = await self.search.run(queries, fetch_pages=bool(fetch_pages))
+        except Exception as e:
+            # Failed searches re-raise whatever the first one hit
+            _LOGGER.error(f"Error while searching {queries}: {repr(e)}")
+            return f"Sorry, I can't do that ({e})"
+        if not results:
+            return "No good Google Search Result was found"
+        return json.dumps(results, ensure_ascii=False)
@@ -1,11 +1,11 @@
-import json
-from typing import Type, Any, Optional
+from typing import Type, Any, List, Optional
 from datetime import datetime, timezone
 from pydantic import BaseModel, Field
-from googleapiclient.discovery import build
 from langchain.tools import BaseTool
 
-from jarvis.tools.google.base import authenticate_with_google
+from jarvis.tools.google.base import execute_batch, google_clients
+from jarvis.tools.google.fields import TASK_FIELDS, compact_json, paginate
+from jarvis.tools.google.tasks_mirror import tasks_mirror
 
 
 class ListGoogleTasksSchema(BaseModel):
@@ -26,6 +26,10 @@ class ListGoogleTasksSchema(BaseModel):
     show_hidden: Optional[bool] = Field(
         False, description="Whether to show hidden tasks. Optional."
     )
+    tasklist: Optional[str] = Field(
+        None,
+        description="Only show tasks from the task list with this name. Optional, defaults to all lists.",
+    )
 
 
 class ListTasksTool(BaseTool):
@@ -43,14 +47,21 @@ class ListTasksTool(BaseTool):
         show_completed: Optional[bool] = False,
         show_deleted: Optional[bool] = False,
         show_hidden: Optional[bool] = False,
+        tasklist: Optional[str] = None,
     ) -> str:
-        creds = authenticate_with_google()
-
-        # Build the Google Tasks API service
-        service = build("tasks", "v1", credentials=creds)
+        # Deleted tasks are dropped from the local mirror
+        if tasks_mirror.ready and not show_deleted:
+            tasks = tasks_mirror.list_tasks(
+                from_datetime,
+                to_datetime,
+                show_completed=bool(show_completed),
+                show_hidden=bool(show_hidden),
+                tasklist=tasklist,
+            )
+            return compact_json(self.name, tasks, f"{TASK_FIELDS},tasklist(title)")
 
-        # Get default tasklist ID
-        default_tasklist_id = service.tasklists().list().execute()["items"][0]["id"]
+        # The local mirror isn't synced yet, so ask the API about the default list
+        service = google_clients.service("tasks", "v1")
         default_tasklist_id = "@default"
 
         # Format the datetime objects to RFC3339
@@ -64,9 +75,10 @@ class ListTasksTool(BaseTool):
         )
 
         # List tasks for the specified time range
-        tasks_result = (
-            service.tasks()
-            .list(
+        tasks = list(
+            paginate(
+                service.tasks(),
+                TASK_FIELDS,
                 tasklist=default_tasklist_id,
                 dueMin=from_datetime_str,
                 dueMax=to_datetime_str,
@@ -74,12 +86,27 @@ class ListTasksTool(BaseTool):
                 showDeleted=show_deleted,
                 showHidden=show_hidden,
             )
-            .execute()
         )
 
-        tasks = tasks_result.get("items", [])
+        return compact_json(self.name, tasks, TASK_FIELDS)
+
 
-        return json.dumps(tasks)
+def _task_body(task_title: str, due_datetime: datetime) -> dict[str, Any]:
+    # Format the datetime object to RFC3339
+    due_datetime_str = due_datetime.astimezone(timezone.utc).isoformat()
+
+    return {
+        "title": task_title,
+        "due": due_datetime_str,
+    }
+
+
+def _apply_to_mirror(created_tasks: List[dict[str, Any]]):
+    # Keep the local mirror coherent right away, then catch up with the API
+    if tasks_mirror.ready:
+        for created_task in created_tasks:
+            tasks_mirror.apply("@default", created_task)
+    tasks_mirror.sync_in_background()
 
 
 class CreateTaskSchema(BaseModel):
@@ -98,29 +125,61 @@ class CreateTaskTool(BaseTool):
         super().__init__(**kwds)
 
     def _run(self, task_title: str, due_datetime: datetime) -> str:
-        creds = authenticate_with_google()
-
-        # Build the Google Tasks API service
-        service = build("tasks", "v1", credentials=creds)
-
-        # Get default tasklist ID
-        default_tasklist_id = service.tasklists().list().execute()["items"][0]["id"]
+        service = google_clients.service("tasks", "v1")
         default_tasklist_id = "@default"
 
-        # Format the datetime object to RFC3339
-        due_datetime_str = due_datetime.astimezone(timezone.utc).isoformat()
-
-        # Create the task body
-        task_body = {
-            "title": task_title,
-            "due": due_datetime_str,
-        }
-
         # Insert the task
         created_task = (
             service.tasks()
-            .insert(tasklist=default_tasklist_id, body=task_body)
+            .insert(
+                tasklist=default_tasklist_id,
+                body=_task_body(task_title, due_datetime),
+                fields=TASK_FIELDS,
+            )
             .execute()
         )
+        _apply_to_mirror([created_task])
+
+        return compact_json(self.name, created_task, TASK_FIELDS)
+
+
+class CreateTasksSchema(BaseModel):
+    tasks: List[CreateTaskSchema] = Field(
+        description="Tasks to create, all at once. Required."
+    )
+
 
-        return json.dumps(created_task)
+class CreateTasksTool(BaseTool):
+    name: str = "google_create_tasks_tool"
+    description: str = "Create several tasks at once using Google Tasks API. Prefer it over multiple calls to google_create_task_tool."
+    args_schema: Type[BaseModel] = CreateTasksSchema
+
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+    def _run(self, tasks: List[CreateTaskSchema | dict[str, Any]]) -> str:
+        service = google_clients.service("tasks", "v1")
+        default_tasklist_id = "@default"
+        tasks = [CreateTaskSchema.model_validate(task) for task in tasks]
+
+        results = execute_batch(
+            service,
+            [
+                service.tasks().insert(
+                    tasklist=default_tasklist_id,
+                    body=_task_body(task.task_title, task.due_datetime),
+                    fields=TASK_FIELDS,
+                )
+                for task in tasks
+            ],
+        )
+        _apply_to_mirror([created for created, error in results if error is None])
+
+        return compact_json(
+            self.name,
+            [
+                {"created": created} if error is None else {"title": task.task_title, "error": error}
+                for task, (created, error) in zip(tasks, results)
+            ],
+            f"title,error,created({TASK_FIELDS})",
+        )
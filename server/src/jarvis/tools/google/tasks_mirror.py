@@ -0,0 +1,163 @@
+import bisect
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, List, Optional
+
+from jarvis.scheduler import run_soon
+from jarvis.tools.google.base import google_clients
+from jarvis.tools.google.fields import paginate
+
+_LOGGER = logging.getLogger(__name__)
+
+SYNC_FIELDS = "id,title,notes,status,due,completed,deleted,hidden,updated,parent"
+# updatedMin is compared to server clocks, so start a bit before our last sync
+CLOCK_SKEW = timedelta(minutes=1)
+
+
+def _timestamp(value: str) -> float:
+    return datetime.fromisoformat(value).timestamp()
+
+
+class TasksMirror:
+    """Local copy of every Google Tasks list. Each list is fetched in full once
+    and then only for tasks changed since the last sync (`updatedMin`). Tasks
+    are indexed by due date and by status."""
+
+    def __init__(self):
+        self.ready = False
+        self.default_tasklist_id: Optional[str] = None
+        self._tasklists: dict[str, dict[str, Any]] = {}
+        self._synced_at: dict[str, datetime] = {}
+        # task id -> task, with the list it belongs to under "tasklist"
+        self._tasks: dict[str, dict[str, Any]] = {}
+        self._due_index: List[tuple[float, str]] = []
+        self._undated: set[str] = set()
+        self._by_status: dict[str, set[str]] = {}
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+
+    def sync(self) -> None:
+        with self._sync_lock:
+            service = google_clients.service("tasks", "v1")
+            tasklists = list(paginate(service.tasklists(), "id,title"))
+
+            changes: List[tuple[str, dict[str, Any]]] = []
+            synced_at = {}
+            for tasklist in tasklists:
+                started = datetime.now(timezone.utc)
+                last_sync = self._synced_at.get(tasklist["id"])
+                for task in paginate(
+                    service.tasks(),
+                    SYNC_FIELDS,
+                    tasklist=tasklist["id"],
+                    showCompleted=True,
+                    showDeleted=True,
+                    showHidden=True,
+                    maxResults=100,
+                    **(
+                        {"updatedMin": (last_sync - CLOCK_SKEW).isoformat()}
+                        if last_sync
+                        else {}
+                    ),
+                ):
+                    changes.append((tasklist["id"], task))
+                synced_at[tasklist["id"]] = started
+
+            with self._lock:
+                removed = set(self._tasklists) - set(synced_at)
+                self._tasks = {
+                    task_id: task
+                    for task_id, task in self._tasks.items()
+                    if task["tasklist"]["id"] not in removed
+                }
+                self._tasklists = {tasklist["id"]: tasklist for tasklist in tasklists}
+                # The first list is the one the API calls "@default"
+                self.default_tasklist_id = tasklists[0]["id"] if tasklists else None
+                for tasklist_id, task in changes:
+                    self._apply(tasklist_id, task)
+                self._reindex()
+                self._synced_at = synced_at
+                self.ready = True
+            _LOGGER.debug(f"Tasks synced, {len(changes)} changes")
+
+    def sync_in_background(self) -> None:
+        # Brings the periodic sync forward, so both never run at once
+        run_soon("sync_tasks", self.sync)
+
+    def apply(self, tasklist_id: str, task: dict[str, Any]) -> None:
+        """Applies a single task we already know about (e.g. one we just created)."""
+        with self._lock:
+            if tasklist_id == "@default" and self.default_tasklist_id:
+                tasklist_id = self.default_tasklist_id
+            self._apply(tasklist_id, task)
+            self._reindex()
+
+    def _apply(self, tasklist_id: str, task: dict[str, Any]) -> None:
+        if task.get("deleted"):
+            self._tasks.pop(task["id"], None)
+            return
+        tasklist = self._tasklists.get(tasklist_id, {"id": tasklist_id})
+        self._tasks[task["id"]] = {
+            **task,
+            "tasklist": {"id": tasklist["id"], "title": tasklist.get("title")},
+        }
+
+    def _reindex(self) -> None:
+        due_index = []
+        undated = set()
+        by_status: dict[str, set[str]] = {}
+        for task_id, task in self._tasks.items():
+            if task.get("due"):
+                due_index.append((_timestamp(task["due"]), task_id))
+            else:
+                undated.add(task_id)
+            by_status.setdefault(task.get("status", "needsAction"), set()).add(task_id)
+        due_index.sort()
+        self._due_index = due_index
+        self._undated = undated
+        self._by_status = by_status
+
+    def list_tasks(
+        self,
+        from_datetime: Optional[datetime] = None,
+        to_datetime: Optional[datetime] = None,
+        show_completed: bool = False,
+        show_hidden: bool = False,
+        tasklist: Optional[str] = None,
+    ) -> List[dict[str, Any]]:
+        with self._lock:
+            if from_datetime is None and to_datetime is None:
+                ids = [task_id for _, task_id in self._due_index] + sorted(self._undated)
+            else:
+                lo = (
+                    bisect.bisect_left(self._due_index, (from_datetime.timestamp(),))
+                    if from_datetime
+                    else 0
+                )
+                hi = (
+                    bisect.bisect_right(self._due_index, (to_datetime.timestamp(), "\uffff"))
+                    if to_datetime
+                    else len(self._due_index)
+                )
+                ids = [task_id for _, task_id in self._due_index[lo:hi]]
+
+            if not show_completed:
+                completed = self._by_status.get("completed", set())
+                ids = [task_id for task_id in ids if task_id not in completed]
+            tasks = [self._tasks[task_id] for task_id in ids]
+
+        if not show_hidden:
+            tasks = [task for task in tasks if not task.get("hidden")]
+        if tasklist:
+            wanted = tasklist.casefold()
+            tasks = [
+                task
+                for task in tasks
+                if wanted in (task["tasklist"]["title"] or "").casefold()
+                or wanted == task["tasklist"]["id"]
+            ]
+        return tasks
+
+
+tasks_mirror = TasksMirror()
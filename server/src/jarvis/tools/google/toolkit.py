@@ -2,15 +2,11 @@ import os
 from typing import List
 from langchain_community.agent_toolkits.base import BaseToolkit
 from langchain_core.tools import BaseTool
-from langchain_google_community import GoogleSearchRun, GoogleSearchAPIWrapper
-from pydantic import BaseModel, Field
 
 from jarvis.tools.google import calendar
+from jarvis.tools.google import gmail
 from jarvis.tools.google import tasks
-
-
-class GoogleSearchInput(BaseModel):
-    query: str = Field(description="Search query.")
+from jarvis.tools.google.search import GoogleSearch, GoogleSearchTool
 
 
 class GoogleToolkit(BaseToolkit):
@@ -19,15 +15,18 @@ class GoogleToolkit(BaseToolkit):
 
     def get_tools(self) -> List[BaseTool]:
         return [
-            GoogleSearchRun(
-                api_wrapper=GoogleSearchAPIWrapper(
-                    google_api_key=os.environ["GOOGLE_API_KEY"],
-                    google_cse_id=os.environ["GOOGLE_CSE_ID"],
-                ),  # type: ignore
-                args_schema=GoogleSearchInput,
+            GoogleSearchTool(
+                search=GoogleSearch(
+                    api_key=os.environ["GOOGLE_API_KEY"],
+                    cse_id=os.environ["GOOGLE_CSE_ID"],
+                )
             ),
             calendar.ListEventsTool(),
             calendar.CreateEventTool(),
+            calendar.CreateEventsTool(),
             tasks.ListTasksTool(),
             tasks.CreateTaskTool(),
+            tasks.CreateTasksTool(),
+            gmail.GmailDigestTool(),
+            gmail.GmailReadMessageTool(),
         ]
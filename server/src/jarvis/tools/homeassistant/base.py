@@ -1,17 +1,53 @@
+from typing import Any, List, Optional
 import httpx
 from pydantic import Field
 from langchain_core.tools import BaseTool
 
+from jarvis.tools.homeassistant.registry import HomeAssistantRegistry, ValidationResult
+
 
 class HomeAssistantBaseTool(BaseTool):
     client: httpx.Client = Field(default_factory=lambda: httpx.Client(timeout=15))
+    async_client: httpx.AsyncClient = Field(
+        default_factory=lambda: httpx.AsyncClient(timeout=60)
+    )
     base_url: str = Field(default_factory=lambda: "")
+    api_key: str = Field(default_factory=lambda: "")
     headers: dict = Field(default_factory=lambda: {})
+    registry: Optional[HomeAssistantRegistry] = None
+    # Arguments holding entity IDs, mapped to the domains they accept (empty for any)
+    entity_args: dict[str, List[str]] = {}
+    # Service called by this tool (e.g. light.turn_on) and the arguments sent as its fields
+    service: Optional[str] = None
+    service_args: List[str] = []
+    # Replies used instead of another LLM call when return_direct is set, by language
+    response_templates: dict[str, str] = {}
 
     def __init__(self, api_key: str, base_url: str, **kwds):
         super(HomeAssistantBaseTool, self).__init__(**kwds)
         self.base_url = base_url
+        self.api_key = api_key
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
         }
+
+    def validate_args(self, args: dict[str, Any]) -> ValidationResult:
+        if self.registry is None or not self.registry.refresh():
+            return ValidationResult(args=args)
+
+        result = self.registry.validate_entities(args, self.entity_args)
+        if self.service:
+            domain, service = self.service.split(".", 1)
+            fields = self.registry.service_fields(domain, service)
+            for arg in self.service_args:
+                if fields is not None and args.get(arg) is not None and arg not in fields:
+                    result.errors.append(
+                        {
+                            "argument": arg,
+                            "value": args[arg],
+                            "problem": f"{self.service} does not accept this attribute",
+                            "suggestions": sorted(fields),
+                        }
+                    )
+        return result
@@ -1,10 +1,11 @@
 import logging
 import json
-from typing import List, Type
+from typing import Any, List, Type
 from pydantic import BaseModel, Field
 from enum import Enum
 
 from jarvis.tools.homeassistant.base import HomeAssistantBaseTool
+from jarvis.tools.homeassistant.registry import ValidationResult
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -28,10 +29,34 @@ class HomeAssistantControlEntitiesTool(HomeAssistantBaseTool):
     name: str = "home_assistant_control_entities"
     description: str = "Useful when you want to control (e.g. turn on or off) one or more Home Assistant entities."
     args_schema: Type[BaseModel] = HomeAssistantControlEntitiesInput
+    entity_args: dict[str, List[str]] = {"entities": []}
+    return_direct: bool = True
+    response_templates: dict[str, str] = {"pt-BR": "Pronto.", "en": "Done."}
 
     def __init__(self, **kwds):
         super().__init__(**kwds)
 
+    def validate_args(self, args: dict[str, Any]) -> ValidationResult:
+        result = super().validate_args(args)
+        try:
+            command = CommandEnum(args.get("command")).value
+        except ValueError:
+            return result
+        if self.registry is None:
+            return result
+        # The generic homeassistant service is called, it maps the command to
+        # each entity's own service (e.g. turn_on opens a cover)
+        if not self.registry.has_service("homeassistant", command):
+            result.errors.append(
+                {
+                    "argument": "command",
+                    "value": command,
+                    "problem": f"homeassistant.{command} is not available",
+                    "suggestions": [],
+                }
+            )
+        return result
+
     def _run(self, command: CommandEnum, entities: List[str]) -> str:
         response = self.client.post(
             f"{self.base_url}/api/services/homeassistant/{command.value}",
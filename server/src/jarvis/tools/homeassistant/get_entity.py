@@ -1,6 +1,6 @@
 import logging
 import json
-from typing import Type
+from typing import List, Type
 from pydantic import BaseModel, Field
 
 from jarvis.tools.homeassistant.base import HomeAssistantBaseTool
@@ -18,6 +18,7 @@ class HomeAssistantGetEntityTool(HomeAssistantBaseTool):
     name: str = "home_assistant_get_entity_state"
     description: str = "Get the current state of a single entity. States can also contain useful attributes about said entity."
     args_schema: Type[BaseModel] = HomeAssistantEntityInput
+    entity_args: dict[str, List[str]] = {"entity": []}
 
     def __init__(self, **kwds):
         super().__init__(**kwds)
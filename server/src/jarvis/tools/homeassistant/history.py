@@ -0,0 +1,323 @@
+import json
+import logging
+from array import array
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import AsyncIterator, List, Optional, Type
+
+import aiohttp
+import httpx
+import numpy as np
+from pydantic import BaseModel, Field
+
+from jarvis.tools.homeassistant.base import HomeAssistantBaseTool
+
+_LOGGER = logging.getLogger(__name__)
+
+# Home Assistant's recorder purges short-term history after 10 days by default,
+# older data only survives as long-term statistics.
+HISTORY_RETENTION = timedelta(days=10)
+DEFAULT_BUCKET_COUNT = 24
+
+
+class HomeAssistantHistoryError(Exception): ...
+
+
+class HistorySource(str, Enum):
+    auto = "auto"
+    history = "history"
+    statistics = "statistics"
+
+
+class HomeAssistantHistoryInput(BaseModel):
+    entities: List[str] = Field(
+        description="The numeric sensor entity IDs to query, e.g. sensor.living_room_temperature"
+    )
+    from_datetime: datetime = Field(
+        description="Start of the period (RFC3339 timestamp with mandatory time zone offset, e.g., 2011-06-03T10:00:00-07:00). Required."
+    )
+    to_datetime: datetime = Field(
+        description="End of the period (RFC3339 timestamp with mandatory time zone offset, e.g., 2011-06-03T10:00:00-07:00). Required."
+    )
+    bucket_minutes: Optional[int] = Field(
+        None,
+        description=f"Size of each aggregation bucket in minutes. Optional, defaults to splitting the period in {DEFAULT_BUCKET_COUNT} buckets.",
+    )
+    source: HistorySource = Field(
+        HistorySource.auto,
+        description="Where to read data from: history (raw state changes, last 10 days), statistics (hourly long-term statistics) or auto.",
+    )
+
+
+class _Series:
+    def __init__(self, entity_id: str, name: Optional[str], unit: Optional[str]):
+        self.entity_id = entity_id
+        self.name = name
+        self.unit = unit
+        self.timestamps = array("d")
+        self.mins = array("d")
+        self.means = array("d")
+        self.maxs = array("d")
+
+    def append(self, timestamp: float, low: float, mean: float, high: float):
+        self.timestamps.append(timestamp)
+        self.mins.append(low)
+        self.means.append(mean)
+        self.maxs.append(high)
+
+
+async def _iter_json_objects(
+    chunks: AsyncIterator[str], depth: int
+) -> AsyncIterator[dict]:
+    """Yields every JSON object found at `depth` nesting level of a streamed
+    document, without ever holding the whole document in memory."""
+    level = 0
+    in_string = escaped = False
+    buffer: List[str] = []
+    async for chunk in chunks:
+        start = 0 if buffer else None
+        for i, char in enumerate(chunk):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in "[{":
+                if level == depth and char == "{":
+                    start = i
+                level += 1
+            elif char in "]}":
+                level -= 1
+                if level == depth and char == "}" and start is not None:
+                    buffer.append(chunk[start : i + 1])
+                    yield json.loads("".join(buffer))
+                    buffer = []
+                    start = None
+        if start is not None:
+            buffer.append(chunk[start:])
+
+
+def _downsample(
+    series: _Series, start: float, bucket: float
+) -> tuple[np.ndarray, ...]:
+    timestamps = np.frombuffer(series.timestamps, dtype=np.float64)
+    indexes = np.maximum((timestamps - start) // bucket, 0).astype(np.int64)
+    order = np.argsort(indexes, kind="stable")
+    indexes = indexes[order]
+    mins = np.frombuffer(series.mins, dtype=np.float64)[order]
+    means = np.frombuffer(series.means, dtype=np.float64)[order]
+    maxs = np.frombuffer(series.maxs, dtype=np.float64)[order]
+
+    buckets, first = np.unique(indexes, return_index=True)
+    counts = np.diff(np.append(first, indexes.size))
+    return (
+        start + buckets * bucket,
+        np.minimum.reduceat(mins, first),
+        np.add.reduceat(means, first) / counts,
+        np.maximum.reduceat(maxs, first),
+        counts,
+    )
+
+
+def _format_series(
+    series: _Series, start: float, bucket: float, tz: Optional[timezone]
+) -> str:
+    label = ", ".join(filter(None, [series.name, series.unit]))
+    header = f"{series.entity_id}{f' ({label})' if label else ''}"
+    if len(series.timestamps) == 0:
+        return f"{header}: no numeric data"
+
+    starts, mins, means, maxs, counts = _downsample(series, start, bucket)
+    overall_mean = float(np.average(means, weights=counts))
+    lines = [
+        f"{header}, {int(bucket // 60)}min buckets: "
+        f"min={mins.min():.2f} mean={overall_mean:.2f} max={maxs.max():.2f}",
+        "start|min|mean|max|n",
+    ]
+    for bucket_start, low, mean, high, count in zip(
+        starts.tolist(), mins.tolist(), means.tolist(), maxs.tolist(), counts.tolist()
+    ):
+        moment = datetime.fromtimestamp(bucket_start, tz).strftime("%m-%d %H:%M")
+        lines.append(f"{moment}|{low:.2f}|{mean:.2f}|{high:.2f}|{count}")
+    return "\n".join(lines)
+
+
+class HomeAssistantHistoryTool(HomeAssistantBaseTool):
+    name: str = "home_assistant_sensor_history"
+    description: str = "Get min/mean/max of numeric sensors over a past period, aggregated in time buckets. Useful for questions like 'what was the average temperature yesterday'."
+    args_schema: Type[BaseModel] = HomeAssistantHistoryInput
+    entity_args: dict[str, List[str]] = {"entities": []}
+
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+    def _run(
+        self,
+        entities: List[str],
+        from_datetime: datetime,
+        to_datetime: datetime,
+        bucket_minutes: Optional[int] = None,
+        source: HistorySource = HistorySource.auto,
+    ) -> str:
+        raise NotImplementedError(
+            "Synchronous execution is not supported for this tool."
+        )
+
+    async def _arun(
+        self,
+        entities: List[str],
+        from_datetime: datetime,
+        to_datetime: datetime,
+        bucket_minutes: Optional[int] = None,
+        source: HistorySource = HistorySource.auto,
+    ) -> str:
+        start = from_datetime.timestamp()
+        end = to_datetime.timestamp()
+        if end <= start or not entities:
+            return "Sorry, I can't do that (invalid period or entities)"
+        bucket = (
+            bucket_minutes * 60
+            if bucket_minutes
+            else max(300.0, (end - start) / DEFAULT_BUCKET_COUNT)
+        )
+
+        if source == HistorySource.auto:
+            too_old = from_datetime < datetime.now(timezone.utc) - HISTORY_RETENTION
+            source = HistorySource.statistics if too_old else HistorySource.history
+
+        try:
+            if source == HistorySource.statistics:
+                all_series = await self._fetch_statistics(
+                    entities, from_datetime, to_datetime, bucket
+                )
+            else:
+                all_series = await self._fetch_history(
+                    entities, from_datetime, to_datetime
+                )
+        except (HomeAssistantHistoryError, httpx.HTTPError, aiohttp.ClientError) as e:
+            _LOGGER.error(f"Error while fetching sensor history: {e}")
+            return f"Sorry, I can't do that (got error {e})"
+
+        return "\n\n".join(
+            _format_series(series, start, bucket, from_datetime.tzinfo)  # type: ignore
+            for series in all_series
+        )
+
+    async def _fetch_history(
+        self, entities: List[str], from_datetime: datetime, to_datetime: datetime
+    ) -> List[_Series]:
+        all_series: dict[str, _Series] = {
+            entity: _Series(entity, None, None) for entity in entities
+        }
+        async with self.async_client.stream(
+            "GET",
+            f"{self.base_url}/api/history/period/{from_datetime.astimezone(timezone.utc).isoformat()}",
+            headers=self.headers,
+            params={
+                "filter_entity_id": ",".join(entities),
+                "end_time": to_datetime.astimezone(timezone.utc).isoformat(),
+                "minimal_response": "",
+            },
+        ) as response:
+            if response.status_code != 200:
+                raise HomeAssistantHistoryError(response.status_code)
+
+            # With minimal_response, only the first state of each entity has
+            # its entity_id and attributes, the following ones are just
+            # {"state", "last_changed"} until the next entity starts.
+            series: Optional[_Series] = None
+            async for state in _iter_json_objects(response.aiter_text(), depth=2):
+                if "entity_id" in state:
+                    attributes = state.get("attributes", {})
+                    series = all_series.setdefault(
+                        state["entity_id"], _Series(state["entity_id"], None, None)
+                    )
+                    series.name = attributes.get("friendly_name")
+                    series.unit = attributes.get("unit_of_measurement")
+                if series is None:
+                    continue
+                try:
+                    value = float(state["state"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                moment = datetime.fromisoformat(state["last_changed"]).timestamp()
+                series.append(moment, value, value, value)
+
+        return list(all_series.values())
+
+    async def _fetch_statistics(
+        self,
+        entities: List[str],
+        from_datetime: datetime,
+        to_datetime: datetime,
+        bucket: float,
+    ) -> List[_Series]:
+        period = "day" if bucket >= 86400 else "hour" if bucket >= 3600 else "5minute"
+        ws_url = f"{self.base_url.replace('http', 'ws', 1)}/api/websocket"
+
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(ws_url, max_msg_size=16 * 2**20) as ws:
+                await ws.receive_json()  # auth_required
+                await ws.send_json({"type": "auth", "access_token": self.api_key})
+                auth = await ws.receive_json()
+                if auth.get("type") != "auth_ok":
+                    raise HomeAssistantHistoryError(auth.get("type"))
+
+                await ws.send_json(
+                    {
+                        "id": 1,
+                        "type": "recorder/get_statistics_metadata",
+                        "statistic_ids": entities,
+                    }
+                )
+                await ws.send_json(
+                    {
+                        "id": 2,
+                        "type": "recorder/statistics_during_period",
+                        "start_time": from_datetime.astimezone(timezone.utc).isoformat(),
+                        "end_time": to_datetime.astimezone(timezone.utc).isoformat(),
+                        "statistic_ids": entities,
+                        "period": period,
+                        "types": ["min", "mean", "max"],
+                    }
+                )
+                results: dict[int, object] = {}
+                while len(results) < 2:
+                    message = await ws.receive_json()
+                    if message.get("type") != "result":
+                        continue
+                    if not message.get("success"):
+                        raise HomeAssistantHistoryError(
+                            message.get("error", {}).get("code")
+                        )
+                    results[message["id"]] = message["result"]
+
+        metadata = {m["statistic_id"]: m for m in results[1]}  # type: ignore
+        all_series = []
+        for entity in entities:
+            meta = metadata.get(entity, {})
+            series = _Series(
+                entity, meta.get("name"), meta.get("statistics_unit_of_measurement")
+            )
+            for row in results[2].get(entity, []):  # type: ignore
+                if row.get("mean") is None:
+                    continue
+                # Newer Home Assistant versions send epoch milliseconds
+                moment = (
+                    row["start"] / 1000
+                    if isinstance(row["start"], (int, float))
+                    else datetime.fromisoformat(row["start"]).timestamp()
+                )
+                low, high = row.get("min"), row.get("max")
+                series.append(
+                    moment,
+                    row["mean"] if low is None else low,
+                    row["mean"],
+                    row["mean"] if high is None else high,
+                )
+            all_series.append(series)
+        return all_series
@@ -24,6 +24,8 @@ class HomeAssistantListAllEntitiesTool(HomeAssistantBaseTool):
             f"{self.base_url}/api/states",
             headers=self.headers,
         )
+        if response.status_code == 200 and self.registry is not None:
+            self.registry.update_states(response.json())
         json_obj = list(
             map(
                 lambda s: {
@@ -1,6 +1,6 @@
 import logging
 import json
-from typing import Type
+from typing import List, Type
 from pydantic import BaseModel, Field
 
 from jarvis.tools.homeassistant.base import HomeAssistantBaseTool
@@ -21,6 +21,12 @@ class HomeAssistantNotifyAlexaTool(HomeAssistantBaseTool):
     name: str = "home_assistant_notify_alexa"
     description: str = "Useful when you want to send/display/ring notification using Alexa, notify in real time."
     args_schema: Type[BaseModel] = HomeAssistantNotifyAlexaInput
+    entity_args: dict[str, List[str]] = {"target": ["media_player"]}
+    return_direct: bool = True
+    response_templates: dict[str, str] = {
+        "pt-BR": "Notificação enviada.",
+        "en": "Notification sent.",
+    }
 
     def __init__(self, **kwds):
         super().__init__(**kwds)
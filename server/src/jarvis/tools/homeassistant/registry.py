@@ -0,0 +1,179 @@
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+from typing import Any, List, Optional
+
+import httpx
+
+_LOGGER = logging.getLogger(__name__)
+
+AUTO_CORRECT_RATIO = 0.85
+AUTO_CORRECT_MARGIN = 0.1
+SUGGESTION_RATIO = 0.5
+MAX_SUGGESTIONS = 5
+# First wait before retrying a failed refresh, doubled up to the ttl
+REFRESH_RETRY_SECONDS = 5.0
+
+
+@dataclass
+class ValidationResult:
+    args: dict[str, Any]
+    corrections: dict[str, str] = field(default_factory=dict)
+    errors: List[dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def to_message(self) -> str:
+        return json.dumps(
+            {
+                "error": "invalid_arguments",
+                "details": self.errors,
+                "hint": "Use one of the suggestions or run home_assistant_list_all_entities.",
+            }
+        )
+
+
+class HomeAssistantRegistry:
+    """Cached index of Home Assistant entities and services, used to validate
+    tool arguments before any call reaches Home Assistant."""
+
+    def __init__(self, base_url: str, api_key: str, ttl: float = 300):
+        self.base_url = base_url
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self.ttl = ttl
+        self.client = httpx.Client(timeout=15)
+        self.entities: dict[str, str] = {}
+        self.services: dict[str, dict[str, set[str]]] = {}
+        self._states_at = 0.0
+        self._services_at = 0.0
+        # While Home Assistant is unreachable, calls don't each wait on a refresh
+        self._retry_at = 0.0
+        self._retry_delay = 0.0
+        self._lock = threading.Lock()
+
+    def update_states(self, states: List[dict[str, Any]]) -> None:
+        self.entities = {
+            s["entity_id"]: s.get("attributes", {}).get("friendly_name") or ""
+            for s in states
+            if "entity_id" in s
+        }
+        self._states_at = time.monotonic()
+
+    def refresh(self) -> bool:
+        """Reloads stale data, returning whether the registry is usable."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._retry_at:
+                return bool(self.entities)
+            try:
+                if now - self._states_at > self.ttl:
+                    response = self.client.get(
+                        f"{self.base_url}/api/states", headers=self.headers
+                    )
+                    response.raise_for_status()
+                    self.update_states(response.json())
+                if now - self._services_at > self.ttl:
+                    response = self.client.get(
+                        f"{self.base_url}/api/services", headers=self.headers
+                    )
+                    response.raise_for_status()
+                    self.services = {
+                        d["domain"]: {
+                            name: set(service.get("fields", {}).keys())
+                            for name, service in d.get("services", {}).items()
+                        }
+                        for d in response.json()
+                    }
+                    self._services_at = now
+                self._retry_delay = 0.0
+            except (httpx.HTTPError, ValueError) as e:
+                self._retry_delay = min(max(self._retry_delay * 2, REFRESH_RETRY_SECONDS), self.ttl)
+                self._retry_at = now + self._retry_delay
+                _LOGGER.warning(
+                    f"Could not refresh Home Assistant registry, "
+                    f"retrying in {self._retry_delay:.0f}s: {e}"
+                )
+        return bool(self.entities)
+
+    def has_service(self, domain: str, service: str) -> bool:
+        return not self.services or service in self.services.get(domain, {})
+
+    def service_fields(self, domain: str, service: str) -> Optional[set[str]]:
+        return self.services.get(domain, {}).get(service)
+
+    def _score(self, wanted: str, entity_id: str) -> float:
+        wanted_object_id = wanted.split(".", 1)[-1]
+        candidates = [entity_id.split(".", 1)[1]]
+        friendly_name = self.entities.get(entity_id)
+        if friendly_name:
+            candidates.append(friendly_name.lower().replace(" ", "_"))
+        return max(
+            SequenceMatcher(None, wanted_object_id, c).ratio() for c in candidates
+        )
+
+    def suggest(self, wanted: str, domains: List[str]) -> List[tuple[str, float]]:
+        wanted = wanted.strip().lower()
+        wanted_domain = wanted.split(".", 1)[0] if "." in wanted else None
+        if not domains and wanted_domain and any(
+            e.startswith(f"{wanted_domain}.") for e in self.entities
+        ):
+            domains = [wanted_domain]
+        scored = [
+            (entity_id, self._score(wanted, entity_id))
+            for entity_id in self.entities
+            if not domains or entity_id.split(".", 1)[0] in domains
+        ]
+        scored = [s for s in scored if s[1] >= SUGGESTION_RATIO]
+        return sorted(scored, key=lambda s: s[1], reverse=True)[:MAX_SUGGESTIONS]
+
+    def resolve_entity(
+        self, wanted: str, domains: List[str]
+    ) -> tuple[Optional[str], List[tuple[str, float]]]:
+        """Returns the entity to use (the same or an unambiguous near-miss)
+        or None along with suggestions."""
+        if wanted in self.entities and (
+            not domains or wanted.split(".", 1)[0] in domains
+        ):
+            return wanted, []
+
+        suggestions = self.suggest(wanted, domains)
+        if suggestions:
+            best = suggestions[0][1]
+            runner_up = suggestions[1][1] if len(suggestions) > 1 else 0
+            if best >= AUTO_CORRECT_RATIO and best - runner_up >= AUTO_CORRECT_MARGIN:
+                return suggestions[0][0], suggestions
+        return None, suggestions
+
+    def validate_entities(
+        self, args: dict[str, Any], entity_args: dict[str, List[str]]
+    ) -> ValidationResult:
+        result = ValidationResult(args=dict(args))
+        for arg, domains in entity_args.items():
+            value = args.get(arg)
+            if value is None:
+                continue
+            values = value if isinstance(value, list) else [value]
+            resolved = []
+            for wanted in values:
+                entity_id, suggestions = self.resolve_entity(wanted, domains)
+                if entity_id is None:
+                    result.errors.append(
+                        {
+                            "argument": arg,
+                            "value": wanted,
+                            "problem": "unknown entity"
+                            + (f" (expected domain {', '.join(domains)})" if domains else ""),
+                            "suggestions": [s[0] for s in suggestions],
+                        }
+                    )
+                    continue
+                if entity_id != wanted:
+                    result.corrections[wanted] = entity_id
+                resolved.append(entity_id)
+            result.args[arg] = resolved if isinstance(value, list) else (resolved or [value])[0]
+        return result
@@ -7,8 +7,10 @@ from langchain_core.tools import BaseTool
 from jarvis.tools.homeassistant.turn_on_lights import HomeAssistantTurnOnLightsTool
 from jarvis.tools.homeassistant.control_entities import HomeAssistantControlEntitiesTool
 from jarvis.tools.homeassistant.get_entity import HomeAssistantGetEntityTool
+from jarvis.tools.homeassistant.history import HomeAssistantHistoryTool
 from jarvis.tools.homeassistant.list_entities import HomeAssistantListAllEntitiesTool
 from jarvis.tools.homeassistant.notify_alexa import HomeAssistantNotifyAlexaTool
+from jarvis.tools.homeassistant.registry import HomeAssistantRegistry
 
 
 class HomeAssistantToolkit(BaseToolkit):
@@ -19,14 +21,13 @@ class HomeAssistantToolkit(BaseToolkit):
         arbitrary_types_allowed = True
 
     def get_tools(self) -> List[BaseTool]:
+        registry = HomeAssistantRegistry(base_url=self.base_url, api_key=self.api_key)
+        kwds = {"base_url": self.base_url, "api_key": self.api_key, "registry": registry}
         return [
-            HomeAssistantTurnOnLightsTool(base_url=self.base_url, api_key=self.api_key),
-            HomeAssistantControlEntitiesTool(
-                base_url=self.base_url, api_key=self.api_key
-            ),
-            HomeAssistantGetEntityTool(base_url=self.base_url, api_key=self.api_key),
-            HomeAssistantListAllEntitiesTool(
-                base_url=self.base_url, api_key=self.api_key
-            ),
-            HomeAssistantNotifyAlexaTool(base_url=self.base_url, api_key=self.api_key),
+            HomeAssistantTurnOnLightsTool(**kwds),
+            HomeAssistantControlEntitiesTool(**kwds),
+            HomeAssistantGetEntityTool(**kwds),
+            HomeAssistantListAllEntitiesTool(**kwds),
+            HomeAssistantNotifyAlexaTool(**kwds),
+            HomeAssistantHistoryTool(**kwds),
         ]
@@ -1,6 +1,6 @@
 import json
 import logging
-from typing import List, Type, Optional
+from typing import Any, List, Type, Optional
 from pydantic import BaseModel, Field
 
 from jarvis.tools.homeassistant.base import HomeAssistantBaseTool
@@ -27,10 +27,22 @@ class HomeAssistantTurnOnLightsTool(HomeAssistantBaseTool):
     name: str = "home_assistant_turn_on_lights"
     description: str = "Turn on one or more lights, controlling their attributes, like color, brightness and transition duration."
     args_schema: Type[BaseModel] = HomeAssistantTurnOnLightsInput
+    entity_args: dict[str, List[str]] = {"entities": ["light"]}
+    service: Optional[str] = "light.turn_on"
+    service_args: List[str] = ["transition", "rgbw_color", "brightness_pct"]
+    return_direct: bool = True
+    response_templates: dict[str, str] = {"pt-BR": "Luzes acesas.", "en": "Lights on."}
+    # brightness_pct=0 turns the lights off
+    off_response_templates: dict[str, str] = {"pt-BR": "Luzes apagadas.", "en": "Lights off."}
 
     def __init__(self, **kwds):
         super().__init__(**kwds)
 
+    def response_template(self, args: dict[str, Any], language: str) -> Optional[str]:
+        if args.get("brightness_pct") == 0:
+            return self.off_response_templates.get(language)
+        return self.response_templates.get(language)
+
     def _run(
         self,
         entities: List[str] = [],
@@ -3,11 +3,10 @@ import json
 import os
 import sys
 import aiofiles
-import pickle
 import re
 import logging
+import time
 from typing import Any, Optional
-from fuzzywuzzy import fuzz
 from nio import (
     AsyncClient,
     AsyncClientConfig,
@@ -16,6 +15,7 @@ from nio import (
     RoomMessageText,
     MegolmEvent,
     RoomKeyRequest,
+    RoomKeyEvent,
     KeyVerificationCancel,
     KeyVerificationKey,
     KeyVerificationMac,
@@ -25,8 +25,16 @@ from nio import (
     SyncResponse,
     RoomSendResponse,
     RoomSendError,
+    RoomMessagesError,
 )
 
+from jarvis import metrics
+from jarvis.tools.matrix.key_requests import KeyRequestManager
+from jarvis.tools.matrix.outbound import OutboundQueue
+from jarvis.tools.matrix.room_index import RoomIndex
+from jarvis.tools.matrix.state_store import MatrixStateStore
+from jarvis.tools.matrix.timeline_store import TimelineStore
+
 _LOGGER = logging.getLogger(__name__)
 
 SESSION_DETAILS_FILE = "matrix_credentials.json"
@@ -34,6 +42,45 @@ STORE_FOLDER = "matrix_store"
 MATRIX_SERVER = os.environ["MATRIX_SERVER"]
 MATRIX_USER = os.environ["MATRIX_USER"]
 MATRIX_PASSWORD = os.environ["MATRIX_PASSWORD"]
+# Bridged rooms are named like "John (@john:beeper.local)" or "John and 3 others"
+DISPLAY_NAME_SUFFIX = re.compile(r'(.*?)( \(@.*| and \d+ others?)?')
+# Candidates scoring this close to the best one make a room name ambiguous
+AMBIGUITY_MARGIN = 3
+BACKFILL_MAX_PAGES = 3
+# Rooms backfilled at once when collecting unread messages
+BACKFILL_CONCURRENCY = 5
+# How long a digest waits for backfills, well below MATRIX_RPC_TIMEOUT; the
+# rest go on in the background and show up in the next digest
+UNREAD_BACKFILL_SECONDS = float(os.environ.get("UNREAD_BACKFILL_SECONDS", 20))
+
+MATRIX_SYNC_TIMELINE_LIMIT = int(os.environ.get("MATRIX_SYNC_TIMELINE_LIMIT", 10))
+# Messages and encryption, plus the state events room names and memberships
+# (and so the room index and megolm sessions) depend on.
+MATRIX_SYNC_EVENT_TYPES = os.environ.get(
+    "MATRIX_SYNC_EVENT_TYPES",
+    "m.room.message,m.room.encrypted,m.room.encryption,m.room.name,m.room.member",
+).split(",")
+
+
+def sync_filter() -> dict[str, Any]:
+    """Server-side sync filter: members are lazy-loaded (only the senders of
+    returned events), the timeline is limited and presence, typing, receipts
+    and room account data are left out (unread counts come from the sync's
+    unread_notifications, not receipts). To-device events are not filtered."""
+    return {
+        "presence": {"types": []},
+        "room": {
+            "state": {"lazy_load_members": True},
+            "timeline": {
+                "limit": MATRIX_SYNC_TIMELINE_LIMIT,
+                "types": MATRIX_SYNC_EVENT_TYPES,
+                "lazy_load_members": True,
+            },
+            "ephemeral": {"types": []},
+            "account_data": {"types": []},
+        },
+    }
+
 
 class CustomEncryptedClient(AsyncClient):
     rooms_info_cache: dict[str, Any] = {}
@@ -60,6 +107,17 @@ class CustomEncryptedClient(AsyncClient):
             ssl=ssl,
             proxy=proxy,
         )
+        self.rooms_info_cache = {}
+        self.room_index = RoomIndex()
+        self.state_store = MatrixStateStore()
+        self.outbound = OutboundQueue(self)
+        # Late-decrypted messages are only stored, handlers like commands
+        # already had their turn when they arrived
+        self.key_requests = KeyRequestManager(self, self._cb_store_decrypted)
+        self.timeline = TimelineStore()
+        self._timeline_buffer: list[tuple[str, str, str, Optional[str], str, int]] = []
+        # Running unread backfills by room, so digests don't start them twice
+        self._unread_backfills: dict[str, asyncio.Task] = {}
         self._register_callbacks()
 
     def _register_callbacks(self):
@@ -68,16 +126,16 @@ class CustomEncryptedClient(AsyncClient):
             os.mkdir(self.store_path)
 
         self.add_event_callback(self._cb_handle_commands, RoomMessageText) # type: ignore
+        self.add_event_callback(self._cb_store_message, RoomMessageText) # type: ignore
         self.add_to_device_callback(self._cb_share_room_key, (RoomKeyRequest,)) # type: ignore
         self.add_to_device_callback(self._cb_key_verification, (KeyVerificationCancel, KeyVerificationKey, KeyVerificationMac, KeyVerificationStart,)) # type: ignore
-        self.add_event_callback(self._cb_olm, MegolmEvent) # type: ignore
+        self.add_event_callback(self.key_requests.on_undecryptable, MegolmEvent) # type: ignore
+        # ForwardedRoomKeyEvent is a RoomKeyEvent too
+        self.add_to_device_callback(self.key_requests.on_room_key, (RoomKeyEvent,)) # type: ignore
         self.add_response_callback(self.retrieve_and_cache_rooms, (SyncResponse,)) # type: ignore
-
-    async def _cb_olm(self, room: MatrixRoom, event: MegolmEvent):
-        try:
-            await self.request_room_key(event)
-        except Exception as e:
-            _LOGGER.error(f"Error while request keys: {repr(e)}")
+        self.add_response_callback(self.persist_sync, (SyncResponse,)) # type: ignore
+        self.add_response_callback(self.flush_timeline, (SyncResponse,)) # type: ignore
+        self.add_response_callback(self.key_requests.process, (SyncResponse,)) # type: ignore
 
     async def login(self) -> None:
         """Log in either using the global variables or (if possible) using the
@@ -216,6 +274,107 @@ class CustomEncryptedClient(AsyncClient):
         except BaseException as e:
             _LOGGER.error('Generic error {e}')
 
+    async def _cb_store_message(self, room: MatrixRoom, event: RoomMessageText):
+        self._timeline_buffer.append(self._timeline_row(room.room_id, event))
+
+    async def _cb_store_decrypted(self, room: MatrixRoom, event: Any):
+        if isinstance(event, RoomMessageText):
+            await self._cb_store_message(room, event)
+
+    def _timeline_row(self, room_id: str, event: RoomMessageText) -> tuple[str, str, str, Optional[str], str, int]:
+        room = self.rooms.get(room_id)
+        sender_name = room.user_name(event.sender) if room else None
+        return (event.event_id, room_id, event.sender, sender_name, event.body, event.server_timestamp)
+
+    async def flush_timeline(self, response: SyncResponse):
+        """Writes the messages received during this sync in one transaction."""
+        rows, self._timeline_buffer = self._timeline_buffer, []
+        if rows:
+            try:
+                await asyncio.to_thread(self.timeline.add, rows)
+            except Exception as e:
+                _LOGGER.error(f'Error while storing messages: {e}')
+
+    async def backfill(self, room_id: str, wanted: int):
+        """Pages back through `room_messages` from where the last backfill
+        stopped, until `wanted` more messages are stored or the room's start."""
+        token, complete = await asyncio.to_thread(self.timeline.backfill_state, room_id)
+        room = self.rooms.get(room_id)
+        for _ in range(BACKFILL_MAX_PAGES):
+            if complete or wanted <= 0:
+                break
+            response = await self.room_messages(room_id, start=token or "", limit=min(100, max(wanted, 20)))
+            if isinstance(response, RoomMessagesError):
+                _LOGGER.error(f"Error while backfilling {room_id}: {response}")
+                break
+            rows = []
+            for event in response.chunk:
+                if isinstance(event, RoomMessageText):
+                    rows.append(self._timeline_row(room_id, event))
+                elif isinstance(event, MegolmEvent) and room:
+                    await self.key_requests.on_undecryptable(room, event)
+            await asyncio.to_thread(self.timeline.add, rows)
+            wanted -= len(rows)
+            complete = not response.chunk or not response.end
+            token = response.end
+        await asyncio.to_thread(self.timeline.set_backfill_state, room_id, token, complete)
+
+    async def last_messages(self, room_id: str, limit: int) -> list[dict[str, Any]]:
+        messages = await asyncio.to_thread(self.timeline.last, room_id, limit)
+        if len(messages) < limit:
+            await self.backfill(room_id, limit - len(messages))
+            messages = await asyncio.to_thread(self.timeline.last, room_id, limit)
+        return messages
+
+    async def unread_messages(
+        self, max_rooms: int, max_per_room: int, wait: float = UNREAD_BACKFILL_SECONDS
+    ) -> list[dict[str, Any]]:
+        """Rooms with unread notifications (mentions first), each with its
+        unread messages, at most `max_per_room` of them. Missing messages are
+        backfilled for up to `wait` seconds, rooms whose backfill is still
+        running only have the messages stored so far."""
+        unread = sorted(
+            (info for info in self.rooms_info_cache.values() if info['unread_notifications']),
+            key=lambda info: (info['unread_highlights'], info['unread_notifications']),
+            reverse=True,
+        )[:max_rooms]
+        semaphore = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+
+        async def backfill(room_id: str, wanted: int):
+            async with semaphore:
+                stored = await asyncio.to_thread(self.timeline.last, room_id, wanted)
+                if len(stored) < wanted:
+                    await self.backfill(room_id, wanted - len(stored))
+
+        tasks = []
+        for info in unread:
+            task = self._unread_backfills.get(info['id'])
+            if task is None:
+                wanted = min(info['unread_notifications'], max_per_room)
+                task = asyncio.ensure_future(backfill(info['id'], wanted))
+                self._unread_backfills[info['id']] = task
+                task.add_done_callback(lambda _, room_id=info['id']: self._unread_backfills.pop(room_id, None))
+            tasks.append(task)
+        if tasks:
+            # Not cancelled on timeout, they carry on for the next digest
+            _, pending = await asyncio.wait(tasks, timeout=wait)
+            if pending:
+                _LOGGER.info(f"Still backfilling {len(pending)} unread rooms")
+
+        async def collect(info: dict[str, Any]) -> dict[str, Any]:
+            messages = await asyncio.to_thread(
+                self.timeline.last, info['id'], min(info['unread_notifications'], max_per_room)
+            )
+            return {
+                'id': info['id'],
+                'display_name': info['display_name'],
+                'unread_notifications': info['unread_notifications'],
+                'unread_highlights': info['unread_highlights'],
+                'messages': messages,
+            }
+
+        return list(await asyncio.gather(*(collect(info) for info in unread)))
+
     async def _cb_handle_commands(self, room: MatrixRoom, event: RoomMessageText):
         if event.decrypted:
             encrypted_symbol = "🛡️ "
@@ -238,8 +397,11 @@ class CustomEncryptedClient(AsyncClient):
                 match = re.match(r"^!s +(?P<search_string>.*)", event.body)
                 if match:
                     search_string = match.group("search_string")
-                    room_info = self.find_room_id_by_name(search_string)
-                    await self.send_message(room.room_id, repr(room_info))
+                    rooms = self.find_rooms_by_name(search_string)
+                    await self.send_message(
+                        room.room_id,
+                        "\n".join(f"{r['ratio']:.0f} {r['display_name']} ({r['source']}) {r['id']}" for r in rooms) or "no rooms found",
+                    )
             elif event.body == "!full_sync":
                 await self.command_full_sync(room, event)
                 await self.send_message(room.room_id, "rooms synced")
@@ -252,107 +414,134 @@ class CustomEncryptedClient(AsyncClient):
     async def command_full_sync(self, room: MatrixRoom, event: RoomMessageText):
         self.next_batch = None
         self.loaded_sync_token = None
-        await self.sync(full_state=True)
+        await self.sync(full_state=True, sync_filter=sync_filter())
+        self.rebuild_rooms_cache()
         await self.command_save_client()
 
     async def command_save_client(self):
+        """Saves every room, replacing whatever was stored."""
         try:
-            persist = {
-                "rooms": self.rooms,
-                "invited_rooms": self.invited_rooms,
-                "encrypted_rooms": self.encrypted_rooms,
-                "next_batch": self.next_batch,
-                "loaded_sync_token": self.loaded_sync_token,
-                "rooms_info_cache": self.rooms_info_cache,
-            }
-            with open('matrix_rooms.pickle', 'wb') as file:
-                pickle.dump(persist, file, protocol=pickle.HIGHEST_PROTOCOL)
-        except:
-            _LOGGER.error('Error while savings rooms to pickle')
+            rows = self.state_store.dump_rooms(self.rooms, list(self.rooms.keys()), self.rooms_info_cache)
+            rows += self.state_store.dump_rooms(self.invited_rooms, list(self.invited_rooms.keys()), {}, invited=True)
+            await asyncio.to_thread(self.state_store.save, self.next_batch, rows, replace=True)
+        except Exception as e:
+            _LOGGER.error(f'Error while saving rooms: {e}')
+
+    async def persist_sync(self, response: SyncResponse):
+        """Saves the rooms changed by this sync and its token in one transaction."""
+        try:
+            changed = set(response.rooms.join) | set(response.rooms.invite) | set(response.rooms.leave)
+            rows = self.state_store.dump_rooms(self.rooms, changed, self.rooms_info_cache)
+            rows += self.state_store.dump_rooms(self.invited_rooms, changed, {}, invited=True)
+            removed = changed - set(self.rooms.keys()) - set(self.invited_rooms.keys())
+            await asyncio.to_thread(self.state_store.save, self.next_batch, rows, removed)
+        except Exception as e:
+            _LOGGER.error(f'Error while saving sync: {e}')
 
     async def try_load_client(self):
         try:
-            with open('matrix_rooms.pickle', 'rb') as file:
-                persisted: dict = pickle.load(file)
-                self.rooms = persisted.get("rooms", [])
-                self.invited_rooms = persisted.get("invited_rooms", [])
-                self.encrypted_rooms = persisted.get("encrypted_rooms", [])
-                self.next_batch = persisted.get("next_batch", None)
-                self.loaded_sync_token = persisted.get("loaded_sync_token", None)
-                self.rooms_info_cache = persisted.get("rooms_info_cache", {})
-        except:
-            _LOGGER.error('Error while loading rooms from pickle')
+            next_batch, rooms, invited_rooms, rooms_info_cache = await asyncio.to_thread(self.state_store.load)
+            # Rooms are only unpickled when something touches them
+            self.rooms = rooms
+            self.invited_rooms = invited_rooms
+            if next_batch:
+                self.next_batch = next_batch
+                self.loaded_sync_token = next_batch
+            self.rooms_info_cache = rooms_info_cache
+            self.room_index.rebuild(self.rooms_info_cache.values())
+        except Exception as e:
+            _LOGGER.error(f'Error while loading rooms: {e}')
 
     async def send_message(self, room_id: str, message: str) -> RoomSendResponse | RoomSendError | None:
         try:
-            # Hack: as all rooms may not be synced, but the user already knows the room_id,
-            # we can do this to avoid errors when sending the message.
-            # I think this is not necessary anymore now that we're persisting rooms.
-            try:
-                self.rooms[room_id]
-            except KeyError:
-                await self.join(room_id)
-                room = MatrixRoom(room_id, self.user_id, True)
-                # room.members_synced = True
-                self.rooms[room_id] = room
-                await self.sync(full_state=False)
-
-            return await self.room_send(
-                room_id=room_id,
-                message_type="m.room.message",
-                content={
+            return await self.outbound.send(
+                room_id,
+                {
                     "msgtype": "m.text",
                     "body": message,
                 },
-                ignore_unverified_devices=True,
             )
         except Exception as e:
             _LOGGER.error(f"Error while sending message: {e}")
 
-    async def retrieve_and_cache_rooms(self, response: SyncResponse):
-        self.rooms_info_cache = {}
-
-        for room_id, room in self.rooms.items():
-            names = set()
-            name_hashmap = {}
-
-            source = None
-            for (name, ids) in room.names.items():
-                if 'bridge bot' in name.lower():
-                    source = name.split()[0]
-                    continue
+    def _room_info(self, room: MatrixRoom) -> dict[str, Any]:
+        names = set()
+        name_hashmap = {}
+
+        source = None
+        for (name, ids) in room.names.items():
+            if 'bridge bot' in name.lower():
+                source = name.split()[0]
+                continue
+            for id in ids:
+                name_hashmap[id] = name
+            # Our own name is in every room, it can't tell them apart
+            if ids != [self.user_id]:
                 names.add(name)
-                for id in ids:
-                    name_hashmap[id] = name
-
-            if (not source):
-                source = room.display_name
-
-            # room_info = response.rooms.join.get(room_id)
-
-            self.rooms_info_cache[room_id] = {
-                'id': room_id,
-                'source': source,
-                'names': list(names),
-                'display_name': re.sub(r'(.*?)( \(@.*| and \d+ others?)?', '\\1', room.display_name),
-                'unread_highlights': room.unread_highlights,
-                'unread_notifications': room.unread_notifications,
-                'name_hashmap': name_hashmap,
-                # 'prev_batch': room_info.timeline.prev_batch,
-                # 'messages': list(map(lambda e: f'{name_hashmap[e.sender]}: {e.body}', filter(lambda e: isinstance(e, RoomMessageText), room_info.timeline.events))),
-            }
 
-    def assoc_ratio(self, room_info: dict[str, Any], room_name: str) -> dict[str, Any]:
+        if (not source):
+            source = room.display_name
+
         return {
-            **room_info,
-            "ratio": fuzz.ratio(room_name.lower(), room_info["display_name"].lower()),
+            'id': room.room_id,
+            'source': source,
+            'names': list(names),
+            'display_name': DISPLAY_NAME_SUFFIX.sub('\\1', room.display_name),
+            'unread_highlights': room.unread_highlights,
+            'unread_notifications': room.unread_notifications,
+            'name_hashmap': name_hashmap,
         }
 
+    def rebuild_rooms_cache(self):
+        self.rooms_info_cache = {
+            room_id: self._room_info(room) for room_id, room in self.rooms.items()
+        }
+        self.room_index.rebuild(self.rooms_info_cache.values())
+
+    async def retrieve_and_cache_rooms(self, response: SyncResponse):
+        start = time.perf_counter()
+        if not self.rooms_info_cache:
+            self.rebuild_rooms_cache()
+            touched = len(self.rooms)
+        else:
+            # Only rooms in this sync's delta can have changed
+            changed = set(response.rooms.join) | set(response.rooms.invite) | set(response.rooms.leave)
+            for room_id in changed:
+                room = self.rooms.get(room_id)
+                if room is None:
+                    self.rooms_info_cache.pop(room_id, None)
+                    self.room_index.remove(room_id)
+                else:
+                    self.rooms_info_cache[room_id] = self._room_info(room)
+                    self.room_index.update(self.rooms_info_cache[room_id])
+            touched = len(changed)
+
+        metrics.observe("matrix.sync.rooms_touched", touched)
+        metrics.observe("matrix.sync.room_cache_seconds", time.perf_counter() - start)
+
+    def find_rooms_by_name(self, room_name: str, limit: int = 5) -> list[dict[str, Any]]:
+        return self.room_index.search(room_name, limit=limit)
+
+    def resolve_room(self, room_name: str) -> tuple[dict[str, Any] | None, str | None]:
+        """Returns the best room for `room_name`, or an error when there's none
+        or other rooms score almost as well."""
+        rooms = self.find_rooms_by_name(room_name, limit=3)
+        if not rooms:
+            return None, f"no room matches {room_name}"
+        ambiguous = [
+            r for r in rooms[1:]
+            if rooms[0]["ratio"] - r["ratio"] < AMBIGUITY_MARGIN
+            and r["display_name"] != rooms[0]["display_name"]
+        ]
+        if ambiguous:
+            names = ", ".join(r["display_name"] for r in rooms[:1] + ambiguous)
+            return None, f"more than one room matches: {names}"
+        return rooms[0], None
+
     def find_room_id_by_name(self, room_name: str) -> dict[str, Any] | None:
-        filtered_rooms = list(filter(lambda r: r["ratio"] >= 60, map(lambda r: self.assoc_ratio(r, room_name), self.rooms_info_cache.values())))
-        sorted_rooms = sorted(filtered_rooms, key=lambda r: r["ratio"])
-        if len(sorted_rooms) > 0:
-            return sorted_rooms[-1]
+        rooms = self.find_rooms_by_name(room_name, limit=1)
+        if len(rooms) > 0:
+            return rooms[0]
 
     @staticmethod
     def __write_details_to_disk(resp: LoginResponse) -> None:
@@ -389,7 +578,12 @@ async def main(enc_client: Optional[CustomEncryptedClient]):
     client = enc_client or main_init()
 
     await client.login()
-    await client.sync_forever(timeout=30000, full_state=True)
+    # Restored rooms are already up to date with the stored sync token
+    await client.sync_forever(
+        timeout=30000,
+        sync_filter=sync_filter(),
+        full_state=client.next_batch is None,
+    )
 
 async def _local_main():
     client = main_init()
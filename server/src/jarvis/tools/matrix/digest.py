@@ -0,0 +1,154 @@
+import asyncio
+import json
+import logging
+import re
+from typing import Any, List, Type
+from pydantic import BaseModel, Field
+from langchain_core.language_models import BaseChatModel
+from langchain_core.tools import BaseTool
+
+from jarvis import metrics
+from jarvis.tokens import count_tokens
+from jarvis.tools.matrix.service import MatrixUnavailable, matrix_service
+from jarvis.tools.matrix.timeline import format_messages
+
+_LOGGER = logging.getLogger(__name__)
+
+MAX_ROOMS = 200
+MAX_MESSAGES_PER_ROOM = 30
+# Prompt tokens per summarisation call, several rooms are packed in each
+BATCH_TOKEN_BUDGET = 6000
+# Rooms this small are shown as they are, summarising them costs more
+VERBATIM_TOKENS = 60
+# "## Chat <n>: " before each room
+HEADER_TOKENS = 8
+
+DIGEST_PROMPT = """Summarise the unread messages of each chat below in one short sentence,
+keeping names, questions asked to me, dates and anything that needs an answer.
+Reply only with a JSON object mapping each chat number to its summary.
+
+"""
+
+_JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def _room_chunk(room: dict[str, Any], budget: int) -> str:
+    """The room's name and messages, dropping the oldest ones until it fits in
+    `budget` tokens."""
+    messages = room["messages"]
+    while True:
+        chunk = f"{room['display_name']}\n{format_messages(messages)}\n"
+        if len(messages) <= 1 or count_tokens(chunk) <= budget:
+            return chunk
+        messages = messages[len(messages) // 4 or 1 :]
+
+
+class MatrixUnreadDigestInput(BaseModel):
+    max_rooms: int = Field(
+        default=50, description="Maximum number of rooms to include, mentions first."
+    )
+
+
+class MatrixUnreadDigestTool(BaseTool):
+    name: str = "matrix_unread_digest"
+    description: str = """Use this to know what I missed: summarises the unread messages of all rooms, groups and people."""
+    args_schema: Type[BaseModel] = MatrixUnreadDigestInput
+
+    llm: BaseChatModel = Field()
+    # room id -> (id of the last message summarised, summary)
+    cache: dict[str, tuple[str, str]] = Field(default_factory=dict)
+
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+    def _run(self, max_rooms: int = 50) -> str:
+        raise NotImplementedError("Synchronous execution is not supported for this tool.")
+
+    async def _arun(self, max_rooms: int = 50) -> str:
+        if not matrix_service.available:
+            return "Sorry, I can't do that."
+        try:
+            rooms = await matrix_service.unread_messages(
+                max(1, min(max_rooms, MAX_ROOMS)), MAX_MESSAGES_PER_ROOM
+            )
+        except MatrixUnavailable as e:
+            return f"Sorry, I can't do that ({e})"
+        if not rooms:
+            return "No unread messages."
+
+        summaries: dict[str, str] = {}
+        pending: List[dict[str, Any]] = []
+        for room in rooms:
+            if not room["messages"]:
+                # Its backfill didn't finish in time, it goes on in the background
+                summaries[room["id"]] = "(still loading, ask again in a moment)"
+                continue
+            last_event_id = room["messages"][-1]["event_id"]
+            cached = self.cache.get(room["id"])
+            if cached and cached[0] == last_event_id:
+                summaries[room["id"]] = cached[1]
+                metrics.increment("matrix.digest.cache_hits")
+                continue
+            text = format_messages(room["messages"])
+            if count_tokens(text) <= VERBATIM_TOKENS:
+                summaries[room["id"]] = text.replace("\n", " / ")
+                continue
+            pending.append(room)
+
+        for room_id, summary in (await self._summarise(pending)).items():
+            summaries[room_id] = summary
+
+        lines = []
+        for room in rooms:
+            mentions = f", {room['unread_highlights']} mentions" if room["unread_highlights"] else ""
+            summary = summaries.get(room["id"], "(couldn't summarise)")
+            lines.append(f"- {room['display_name']} ({room['unread_notifications']} unread{mentions}): {summary}")
+        return "\n".join(lines)
+
+    def _batches(self, rooms: List[dict[str, Any]]) -> List[List[tuple[dict[str, Any], str]]]:
+        """Packs room chunks into as few prompts as the token budget allows."""
+        budget = BATCH_TOKEN_BUDGET - count_tokens(DIGEST_PROMPT) - HEADER_TOKENS
+        batches: List[List[tuple[dict[str, Any], str]]] = []
+        used = budget
+        for room in rooms:
+            chunk = _room_chunk(room, budget)
+            tokens = count_tokens(chunk) + HEADER_TOKENS
+            if used + tokens > budget:
+                batches.append([])
+                used = 0
+            batches[-1].append((room, chunk))
+            used += tokens
+        return batches
+
+    def _prompt(self, batch: List[tuple[dict[str, Any], str]]) -> str:
+        return DIGEST_PROMPT + "".join(
+            f"## Chat {number}: {chunk}" for number, (_, chunk) in enumerate(batch, start=1)
+        )
+
+    async def _summarise(self, rooms: List[dict[str, Any]]) -> dict[str, str]:
+        if not rooms:
+            return {}
+        batches = self._batches(rooms)
+        metrics.increment("matrix.digest.llm_calls", len(batches))
+        metrics.increment("matrix.digest.rooms_summarised", len(rooms))
+        responses = await asyncio.gather(
+            *(self.llm.ainvoke(self._prompt(batch)) for batch in batches),
+            return_exceptions=True,
+        )
+
+        summaries = {}
+        for batch, response in zip(batches, responses):
+            if isinstance(response, BaseException):
+                _LOGGER.error(f"Error while summarising unread messages: {repr(response)}")
+                continue
+            match = _JSON_OBJECT.search(str(response.content))
+            try:
+                by_number = json.loads(match.group(0)) if match else {}
+            except json.JSONDecodeError:
+                by_number = {}
+            for number, (room, _) in enumerate(batch, start=1):
+                summary = by_number.get(str(number))
+                if summary:
+                    summaries[room["id"]] = summary
+                    self.cache[room["id"]] = (room["messages"][-1]["event_id"], summary)
+        return summaries
@@ -0,0 +1,149 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, List
+
+from nio import (
+    AsyncClient,
+    EncryptionError,
+    LocalProtocolError,
+    MatrixRoom,
+    MegolmEvent,
+    RoomKeyEvent,
+)
+
+from jarvis import metrics
+
+_LOGGER = logging.getLogger(__name__)
+
+# Key requests sent per second, overall and per device that encrypted the event
+GLOBAL_RATE, GLOBAL_BURST = 2.0, 10
+DEVICE_RATE, DEVICE_BURST = 0.2, 3
+BACKOFF_SECONDS = 30.0
+MAX_BACKOFF_SECONDS = 60 * 60.0
+# Sessions nobody answered for this long are forgotten, with their events
+MAX_PENDING_SECONDS = 24 * 60 * 60.0
+MAX_EVENTS_PER_SESSION = 50
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: dict[str, tuple[float, float]] = {}
+
+    def take(self, key: str = "") -> bool:
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key, (float(self.burst), now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return False
+        self._buckets[key] = (tokens - 1, now)
+        return True
+
+
+@dataclass
+class PendingSession:
+    session_id: str
+    device_id: str
+    events: List[tuple[MatrixRoom, MegolmEvent, float]] = field(default_factory=list)
+    attempts: int = 0
+    next_attempt: float = 0.0
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class KeyRequestManager:
+    """Requests missing megolm keys once per session (not once per event),
+    within global and per-device rate limits and with exponential backoff
+    between retries. Events waiting for a key are decrypted and handed to
+    `on_decrypted` as soon as it arrives. Not to every event callback: by then
+    they may be old, and e.g. a `!command` must not run late."""
+
+    def __init__(
+        self,
+        client: AsyncClient,
+        on_decrypted: Callable[[MatrixRoom, Any], Awaitable[None]],
+    ):
+        self.client = client
+        self.on_decrypted = on_decrypted
+        self._pending: dict[str, PendingSession] = {}
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._devices = TokenBucket(DEVICE_RATE, DEVICE_BURST)
+
+    async def on_undecryptable(self, room: MatrixRoom, event: MegolmEvent):
+        session = self._pending.get(event.session_id)
+        if session is None:
+            session = self._pending[event.session_id] = PendingSession(
+                event.session_id, event.device_id
+            )
+            metrics.observe("matrix.keys.pending_sessions", len(self._pending))
+        else:
+            metrics.increment("matrix.keys.deduplicated")
+        if len(session.events) < MAX_EVENTS_PER_SESSION:
+            session.events.append((room, event, time.monotonic()))
+        await self.process()
+
+    async def process(self, *_: Any):
+        """Sends the requests that are due. Runs on every new undecryptable
+        event and after every sync, which is what drives the retries."""
+        now = time.monotonic()
+        for session_id, session in list(self._pending.items()):
+            if now - session.created_at > MAX_PENDING_SECONDS:
+                del self._pending[session_id]
+                metrics.increment("matrix.keys.expired")
+                continue
+            if session.next_attempt > now:
+                continue
+            if not self._global.take():
+                break
+            if not self._devices.take(session.device_id):
+                continue
+            await self._request(session)
+        metrics.observe("matrix.keys.pending_sessions", len(self._pending))
+
+    async def _request(self, session: PendingSession):
+        outgoing = self.client.outgoing_key_requests
+        if session.session_id in outgoing:
+            if session.attempts == 0:
+                # Requested before we restarted, give it time to be answered
+                session.attempts = 1
+                session.next_attempt = time.monotonic() + BACKOFF_SECONDS
+                return
+            # Nobody answered, forget the old request so it can be sent again
+            request = outgoing.pop(session.session_id)
+            if self.client.olm:
+                self.client.olm.store.remove_outgoing_key_request(request)
+
+        _, event, _ = session.events[-1]
+        session.attempts += 1
+        session.next_attempt = time.monotonic() + min(
+            BACKOFF_SECONDS * 2 ** (session.attempts - 1), MAX_BACKOFF_SECONDS
+        )
+        try:
+            await self.client.request_room_key(event)
+            metrics.increment("matrix.keys.requested")
+        except LocalProtocolError as e:
+            _LOGGER.debug(f"Key request for {session.session_id} not sent: {e}")
+        except Exception as e:
+            _LOGGER.error(f"Error while requesting room key: {repr(e)}")
+
+    async def on_room_key(self, event: RoomKeyEvent):
+        session = self._pending.pop(event.session_id, None)
+        if session is None:
+            return
+        metrics.observe("matrix.keys.pending_sessions", len(self._pending))
+
+        for room, megolm_event, received_at in session.events:
+            try:
+                decrypted = self.client.decrypt_event(megolm_event)
+            except EncryptionError as e:
+                _LOGGER.info(f"Still can't decrypt {megolm_event.event_id}: {e}")
+                continue
+            metrics.observe(
+                "matrix.keys.decryption_latency_seconds", time.monotonic() - received_at
+            )
+            try:
+                await self.on_decrypted(room, decrypted)
+            except Exception as e:
+                _LOGGER.error(f"Error handling decrypted event: {repr(e)}")
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any
+from uuid import uuid4
+
+from nio import (
+    AsyncClient,
+    JoinError,
+    LocalProtocolError,
+    MatrixRoom,
+    RoomSendError,
+    RoomSendResponse,
+)
+
+from jarvis import metrics
+
+_LOGGER = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 30.0
+
+
+@dataclass
+class OutboundMessage:
+    room_id: str
+    content: dict[str, Any]
+    message_type: str = "m.room.message"
+    # Reused on every retry, so the homeserver drops duplicates
+    tx_id: str = field(default_factory=lambda: str(uuid4()))
+    future: asyncio.Future = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future()
+    )
+
+
+class OutboundQueue:
+    """Sends messages in order within each room and concurrently across rooms,
+    one worker per room with pending messages. Rate limits (M_LIMIT_EXCEEDED)
+    are waited out and other failures retried with backoff, always with the
+    same transaction id."""
+
+    def __init__(self, client: AsyncClient):
+        self.client = client
+        self._queues: dict[str, deque[OutboundMessage]] = {}
+        self._workers: dict[str, asyncio.Task] = {}
+
+    async def send(
+        self, room_id: str, content: dict[str, Any], message_type: str = "m.room.message"
+    ) -> RoomSendResponse | RoomSendError:
+        """Queues a message and waits until the homeserver acknowledges it."""
+        message = OutboundMessage(room_id, content, message_type)
+        self._queues.setdefault(room_id, deque()).append(message)
+        metrics.observe("matrix.outbound.queue_depth", len(self._queues[room_id]))
+        if room_id not in self._workers:
+            self._workers[room_id] = asyncio.create_task(self._work(room_id))
+        return await message.future
+
+    async def _work(self, room_id: str):
+        queue = self._queues[room_id]
+        try:
+            await self._prepare_room(room_id)
+            while queue:
+                message = queue[0]
+                try:
+                    result = await self._deliver(message)
+                    if not message.future.done():
+                        message.future.set_result(result)
+                except Exception as e:
+                    if not message.future.done():
+                        message.future.set_exception(e)
+                queue.popleft()
+        except Exception as e:
+            while queue:
+                message = queue.popleft()
+                if not message.future.done():
+                    message.future.set_exception(e)
+        finally:
+            del self._workers[room_id]
+            del self._queues[room_id]
+
+    async def _prepare_room(self, room_id: str):
+        client = self.client
+        if room_id not in client.rooms:
+            # We know the room id but not the room (e.g. never synced), join it
+            # and track it right away instead of waiting for a sync
+            response = await client.join(room_id)
+            if isinstance(response, JoinError):
+                raise LocalProtocolError(f"Can't join {room_id}: {response}")
+            client.rooms[room_id] = MatrixRoom(room_id, client.user_id, True)
+
+        room = client.rooms[room_id]
+        if not room.members_synced:
+            await client.joined_members(room_id)
+        # Share the megolm session once here, every queued message then reuses it
+        if room.encrypted and client.olm and client.olm.should_share_group_session(room_id):
+            await client.share_group_session(room_id, ignore_unverified_devices=True)
+
+    async def _deliver(self, message: OutboundMessage) -> RoomSendResponse | RoomSendError:
+        delay = BACKOFF_SECONDS
+        response: RoomSendResponse | RoomSendError | None = None
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                response = await self.client.room_send(
+                    room_id=message.room_id,
+                    message_type=message.message_type,
+                    content=message.content,
+                    tx_id=message.tx_id,
+                    ignore_unverified_devices=True,
+                )
+            except (LocalProtocolError, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                _LOGGER.warning(f"Error sending to {message.room_id} (attempt {attempt + 1}): {e}")
+                metrics.increment("matrix.outbound.retries")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_BACKOFF_SECONDS)
+                continue
+
+            if isinstance(response, RoomSendResponse):
+                metrics.increment("matrix.outbound.sent")
+                return response
+            if response.status_code == "M_LIMIT_EXCEEDED":
+                metrics.increment("matrix.outbound.rate_limited")
+                wait = (response.retry_after_ms or delay * 1000) / 1000
+                _LOGGER.info(f"Rate limited sending to {message.room_id}, waiting {wait}s")
+                await asyncio.sleep(wait)
+                continue
+            # Other errors (forbidden, unknown room...) won't go away by retrying
+            break
+
+        metrics.increment("matrix.outbound.failed")
+        if response is None:
+            raise LocalProtocolError(f"Couldn't send to {message.room_id}")
+        return response
@@ -0,0 +1,94 @@
+import unicodedata
+from collections import Counter
+from typing import Any, Iterable, List
+
+from rapidfuzz import fuzz, process
+
+MIN_SCORE = 60
+MAX_CANDIDATES = 200
+# Member names and the bridge source score this much less than the display
+# name, so a DM named "John" ranks above every group John is in
+SECONDARY_KEY_PENALTY = 15
+
+
+def normalize_name(name: str) -> str:
+    """Casefolds and strips accents, so "joão" matches "Joao"."""
+    text = unicodedata.normalize("NFKD", name.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.split())
+
+
+def _trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class RoomIndex:
+    """Fuzzy lookup of rooms by display name, member names and bridge source.
+    A trigram index narrows the candidates, which rapidfuzz then scores."""
+
+    def __init__(self):
+        self._rooms: dict[str, dict[str, Any]] = {}
+        self._keys: dict[str, List[str]] = {}
+        self._trigrams: dict[str, set[str]] = {}
+
+    def rebuild(self, rooms: Iterable[dict[str, Any]]) -> None:
+        self._rooms, self._keys, self._trigrams = {}, {}, {}
+        for room_info in rooms:
+            self.update(room_info)
+
+    def update(self, room_info: dict[str, Any]) -> None:
+        room_id = room_info["id"]
+        self.remove(room_id)
+        keys = [room_info["display_name"], *room_info["names"], room_info["source"]]
+        keys = list(dict.fromkeys(normalize_name(k) for k in keys if k))
+        self._rooms[room_id] = room_info
+        self._keys[room_id] = keys
+        for key in keys:
+            for trigram in _trigrams(key):
+                self._trigrams.setdefault(trigram, set()).add(room_id)
+
+    def remove(self, room_id: str) -> None:
+        if self._rooms.pop(room_id, None) is None:
+            return
+        for key in self._keys.pop(room_id):
+            for trigram in _trigrams(key):
+                room_ids = self._trigrams.get(trigram)
+                if room_ids is not None:
+                    room_ids.discard(room_id)
+                    if not room_ids:
+                        del self._trigrams[trigram]
+
+    def _candidates(self, query: str) -> Iterable[str]:
+        hits: Counter[str] = Counter()
+        for trigram in _trigrams(query):
+            hits.update(self._trigrams.get(trigram, ()))
+        return [room_id for room_id, _ in hits.most_common(MAX_CANDIDATES)]
+
+    def search(
+        self, name: str, limit: int = 5, min_score: float = MIN_SCORE
+    ) -> List[dict[str, Any]]:
+        query = normalize_name(name)
+        if not query:
+            return []
+        choices = {
+            (room_id, i): key
+            for room_id in self._candidates(query)
+            for i, key in enumerate(self._keys[room_id])
+        }
+        # room id -> (score, -key position, key): on ties, the display name
+        # (first key) beats member names and the bridge source
+        best: dict[str, tuple[float, int, str]] = {}
+        for key, score, (room_id, i) in process.extract(
+            query, choices, scorer=fuzz.WRatio, score_cutoff=min_score, limit=None
+        ):
+            if i > 0:
+                score -= SECONDARY_KEY_PENALTY
+                if score < min_score:
+                    continue
+            best[room_id] = max(best.get(room_id, (-1, 0, "")), (score, -i, key))
+        ranked = sorted(best.items(), key=lambda item: item[1][:2], reverse=True)
+        return [
+            {**self._rooms[room_id], "ratio": score, "matched": key}
+            for room_id, (score, _, key) in ranked[:limit]
+        ]
@@ -4,6 +4,8 @@ from pydantic import BaseModel, Field
 from langchain_core.tools import BaseTool
 from nio import RoomSendResponse
 
+from jarvis.tools.matrix.service import MatrixUnavailable, matrix_service
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -30,15 +32,20 @@ consider "do you want to dinner tonight?" as the message."""
         raise NotImplementedError("Synchronous execution is not supported for this tool.")
 
     async def _arun(self, room_name: str, message: str) -> str:
-        from jarvis.tools.matrix.base import client
-        if client:
-            room_info = client.find_room_id_by_name(room_name)
-            if room_info:
-                resp = await client.send_message(room_info["id"], message)
-
-                return (
-                    "Message sent successfully."
-                    if isinstance(resp, RoomSendResponse)
-                    else f"Sorry, I can't do that."
-                )
-        return "Sorry, I can't do that."
+        if not matrix_service.available:
+            return "Sorry, I can't do that."
+        try:
+            room_info, error = await matrix_service.resolve_room(room_name)
+            if error:
+                return f"Sorry, I can't do that ({error})"
+            if not room_info:
+                return "Sorry, I can't do that."
+            resp = await matrix_service.send_message(room_info["id"], message)
+        except MatrixUnavailable as e:
+            return f"Sorry, I can't do that ({e})"
+
+        return (
+            "Message sent successfully."
+            if isinstance(resp, RoomSendResponse)
+            else f"Sorry, I can't do that ({resp})."
+        )
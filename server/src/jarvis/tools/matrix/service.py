@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, List, Optional, TypeVar
+
+from nio import RoomSendError, RoomSendResponse
+
+if TYPE_CHECKING:
+    from jarvis.tools.matrix.base import CustomEncryptedClient
+
+_LOGGER = logging.getLogger(__name__)
+
+MATRIX_RPC_TIMEOUT = float(os.environ.get("MATRIX_RPC_TIMEOUT", "60"))
+
+T = TypeVar("T")
+
+
+class MatrixUnavailable(Exception):
+    """Matrix isn't running, or didn't answer in time."""
+
+
+class MatrixService:
+    """Runs the Matrix client on its own event loop, in a daemon thread, so
+    long sync batches and olm crypto never block the server loop. Callers on
+    any other loop use the async methods below, which run on the Matrix loop
+    and hand the result back."""
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.client: Optional["CustomEncryptedClient"] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None and self.loop is not None and self.loop.is_running()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="matrix", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        from jarvis.tools.matrix import base
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.loop = loop
+        try:
+            # The client (and its aiohttp session) must belong to this loop
+            self.client = base.main_init()
+            loop.run_until_complete(base.main(self.client))
+        except Exception as e:
+            _LOGGER.exception(f"Matrix loop stopped: {repr(e)}")
+        finally:
+            self.client = None
+            loop.close()
+
+    async def call(
+        self,
+        fn: Callable[["CustomEncryptedClient"], Awaitable[T]],
+        timeout: float = MATRIX_RPC_TIMEOUT,
+    ) -> T:
+        """Runs `fn(client)` on the Matrix loop and awaits it from the caller's.
+        Raises MatrixUnavailable if it isn't running or doesn't answer in time."""
+        if not self.available:
+            raise MatrixUnavailable("Matrix isn't running")
+        future = asyncio.run_coroutine_threadsafe(fn(self.client), self.loop)  # type: ignore
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            # Also stops the work on the Matrix loop
+            future.cancel()
+            raise MatrixUnavailable(f"Matrix didn't answer in {timeout:g}s")
+
+    async def resolve_room(self, room_name: str) -> tuple[dict[str, Any] | None, str | None]:
+        async def resolve(client: "CustomEncryptedClient"):
+            return client.resolve_room(room_name)
+
+        return await self.call(resolve)
+
+    async def find_room_id_by_name(self, room_name: str) -> dict[str, Any] | None:
+        async def find(client: "CustomEncryptedClient"):
+            return client.find_room_id_by_name(room_name)
+
+        return await self.call(find)
+
+    async def send_message(self, room_id: str, message: str) -> RoomSendResponse | RoomSendError | None:
+        return await self.call(lambda client: client.send_message(room_id, message))
+
+    async def last_messages(self, room_id: str, limit: int) -> List[dict[str, Any]]:
+        return await self.call(lambda client: client.last_messages(room_id, limit))
+
+    async def unread_messages(self, max_rooms: int, max_per_room: int) -> List[dict[str, Any]]:
+        return await self.call(lambda client: client.unread_messages(max_rooms, max_per_room))
+
+    async def search_messages(
+        self, query: str, room_ids: Optional[List[str]], sender: Optional[str], limit: int
+    ) -> List[dict[str, Any]]:
+        """Matching messages, newest first, with the name of their room."""
+
+        async def search(client: "CustomEncryptedClient"):
+            messages = await asyncio.to_thread(client.timeline.search, query, room_ids, sender, limit)
+            for message in messages:
+                room_info = client.rooms_info_cache.get(message["room_id"], {})
+                message["room_name"] = room_info.get("display_name", message["room_id"])
+            return messages
+
+        return await self.call(search)
+
+
+matrix_service = MatrixService()
@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+from typing import Any, Iterable, Optional
+
+from nio import MatrixRoom
+
+_LOGGER = logging.getLogger(__name__)
+
+MATRIX_STATE_DB = os.environ.get("MATRIX_STATE_DB", "matrix_state.db")
+
+_UNLOADED = object()
+
+
+class LazyRooms(dict):
+    """Room dict whose values are unpickled on first access, so startup only
+    reads the room ids. Iterating over values still loads everything."""
+
+    def __init__(self, blobs: dict[str, bytes]):
+        super().__init__((room_id, _UNLOADED) for room_id in blobs)
+        self._blobs = blobs
+
+    def _load(self, room_id: str) -> Any:
+        room = pickle.loads(self._blobs.pop(room_id))
+        super().__setitem__(room_id, room)
+        return room
+
+    def __getitem__(self, room_id: str) -> Any:
+        value = super().__getitem__(room_id)
+        return self._load(room_id) if value is _UNLOADED else value
+
+    def get(self, room_id: str, default: Any = None) -> Any:
+        return self[room_id] if room_id in self else default
+
+    def pop(self, room_id: str, *default: Any) -> Any:
+        if room_id in self:
+            value = self[room_id]
+            super().pop(room_id)
+            return value
+        return super().pop(room_id, *default)
+
+    def __setitem__(self, room_id: str, room: Any) -> None:
+        self._blobs.pop(room_id, None)
+        super().__setitem__(room_id, room)
+
+    def __delitem__(self, room_id: str) -> None:
+        self._blobs.pop(room_id, None)
+        super().__delitem__(room_id)
+
+    def values(self):  # type: ignore
+        return [self[room_id] for room_id in list(self.keys())]
+
+    def items(self):  # type: ignore
+        return [(room_id, self[room_id]) for room_id in list(self.keys())]
+
+    def blob(self, room_id: str) -> Optional[bytes]:
+        """The still-pickled room, if it wasn't loaded yet."""
+        return self._blobs.get(room_id)
+
+
+class MatrixStateStore:
+    """Rooms, room info and the sync token in SQLite (WAL). Each sync writes
+    only the rooms it changed, in a single transaction."""
+
+    def __init__(self, path: str = MATRIX_STATE_DB):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.executescript(
+                """
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                CREATE TABLE IF NOT EXISTS sync (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS rooms (
+                    room_id TEXT PRIMARY KEY,
+                    invited INTEGER NOT NULL DEFAULT 0,
+                    room BLOB NOT NULL,
+                    info TEXT
+                );
+                """
+            )
+            self._connection = connection
+        return self._connection
+
+    def load(self) -> tuple[Optional[str], LazyRooms, LazyRooms, dict[str, Any]]:
+        """Returns the sync token, joined and invited rooms (still pickled) and
+        the room info cache."""
+        with self._lock:
+            db = self._connect()
+            row = db.execute("SELECT value FROM sync WHERE key = 'next_batch'").fetchone()
+            joined: dict[str, bytes] = {}
+            invited: dict[str, bytes] = {}
+            info: dict[str, Any] = {}
+            for room_id, is_invited, room, room_info in db.execute(
+                "SELECT room_id, invited, room, info FROM rooms"
+            ):
+                (invited if is_invited else joined)[room_id] = room
+                if room_info:
+                    info[room_id] = json.loads(room_info)
+        return row[0] if row else None, LazyRooms(joined), LazyRooms(invited), info
+
+    def dump_rooms(
+        self,
+        rooms: dict[str, MatrixRoom],
+        room_ids: Iterable[str],
+        info: dict[str, Any],
+        invited: bool = False,
+    ) -> list[tuple[str, int, bytes, Optional[str]]]:
+        """Pickles rooms on the caller's thread (the event loop, where rooms are
+        mutated), so `save` can run anywhere."""
+        rows = []
+        for room_id in room_ids:
+            if room_id not in rooms:
+                continue
+            blob = rooms.blob(room_id) if isinstance(rooms, LazyRooms) else None
+            if blob is None:
+                blob = pickle.dumps(rooms[room_id], protocol=pickle.HIGHEST_PROTOCOL)
+            room_info = json.dumps(info[room_id]) if room_id in info else None
+            rows.append((room_id, int(invited), blob, room_info))
+        return rows
+
+    def save(
+        self,
+        next_batch: Optional[str],
+        rows: list[tuple[str, int, bytes, Optional[str]]],
+        removed: Iterable[str] = (),
+        replace: bool = False,
+    ) -> None:
+        with self._lock:
+            db = self._connect()
+            with db:
+                if replace:
+                    db.execute("DELETE FROM rooms")
+                db.executemany(
+                    "INSERT OR REPLACE INTO rooms (room_id, invited, room, info) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                db.executemany(
+                    "DELETE FROM rooms WHERE room_id = ?", [(r,) for r in removed]
+                )
+                db.execute(
+                    "INSERT OR REPLACE INTO sync (key, value) VALUES ('next_batch', ?)",
+                    (next_batch,),
+                )
@@ -0,0 +1,99 @@
+import logging
+from datetime import datetime
+from typing import Any, List, Optional, Type
+from pydantic import BaseModel, Field
+from langchain_core.tools import BaseTool
+
+from jarvis.tools.matrix.service import MatrixUnavailable, matrix_service
+
+_LOGGER = logging.getLogger(__name__)
+
+MAX_MESSAGES = 100
+
+
+def format_messages(messages: List[dict[str, Any]]) -> str:
+    lines = []
+    for message in messages:
+        when = datetime.fromtimestamp(message["ts"] / 1000).strftime("%Y-%m-%d %H:%M")
+        room = f"({message['room_name']}) " if "room_name" in message else ""
+        sender = message["sender_name"] or message["sender"]
+        lines.append(f"[{when}] {room}{sender}: {message['body']}")
+    return "\n".join(lines)
+
+
+class MatrixLastMessagesInput(BaseModel):
+    room_name: str = Field(
+        description="Name of the room, group or person you want to get the last messages from."
+    )
+    limit: int = Field(
+        default=20, description="How many messages to get, most recent last."
+    )
+
+
+class MatrixLastMessagesTool(BaseTool):
+    name: str = "matrix_last_messages"
+    description: str = "Use this to read the last messages of a room, group or person."
+    args_schema: Type[BaseModel] = MatrixLastMessagesInput
+
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+    def _run(self, room_name: str, limit: int = 20) -> str:
+        raise NotImplementedError("Synchronous execution is not supported for this tool.")
+
+    async def _arun(self, room_name: str, limit: int = 20) -> str:
+        if not matrix_service.available:
+            return "Sorry, I can't do that."
+        try:
+            room_info, error = await matrix_service.resolve_room(room_name)
+            if error or not room_info:
+                return f"Sorry, I can't do that ({error})"
+            messages = await matrix_service.last_messages(room_info["id"], max(1, min(limit, MAX_MESSAGES)))
+        except MatrixUnavailable as e:
+            return f"Sorry, I can't do that ({e})"
+        if not messages:
+            return f"No messages found in {room_info['display_name']}."
+        return format_messages(messages)
+
+
+class MatrixSearchMessagesInput(BaseModel):
+    query: str = Field(description="Words to look for in the messages.")
+    room_name: Optional[str] = Field(
+        default=None, description="Only search the messages of this room, group or person."
+    )
+    sender: Optional[str] = Field(
+        default=None, description="Only search the messages sent by this person."
+    )
+    limit: int = Field(default=20, description="Maximum number of messages to return.")
+
+
+class MatrixSearchMessagesTool(BaseTool):
+    name: str = "matrix_search_messages"
+    description: str = """Use this to search messages across all rooms by their content.
+Only messages already seen are searched, use matrix_last_messages to load older ones of a room."""
+    args_schema: Type[BaseModel] = MatrixSearchMessagesInput
+
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+    def _run(self, query: str, room_name: Optional[str] = None, sender: Optional[str] = None, limit: int = 20) -> str:
+        raise NotImplementedError("Synchronous execution is not supported for this tool.")
+
+    async def _arun(self, query: str, room_name: Optional[str] = None, sender: Optional[str] = None, limit: int = 20) -> str:
+        if not matrix_service.available:
+            return "Sorry, I can't do that."
+        room_ids = None
+        try:
+            if room_name:
+                room_info, error = await matrix_service.resolve_room(room_name)
+                if error or not room_info:
+                    return f"Sorry, I can't do that ({error})"
+                room_ids = [room_info["id"]]
+            messages = await matrix_service.search_messages(
+                query, room_ids, sender, max(1, min(limit, MAX_MESSAGES))
+            )
+        except MatrixUnavailable as e:
+            return f"Sorry, I can't do that ({e})"
+        if not messages:
+            return "No messages found."
+        return format_messages(list(reversed(messages)))
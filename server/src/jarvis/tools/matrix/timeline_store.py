@@ -0,0 +1,126 @@
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, List, Optional
+
+MATRIX_TIMELINE_DB = os.environ.get("MATRIX_TIMELINE_DB", "matrix_timeline.db")
+
+_WORD = re.compile(r"\w+")
+
+
+def fts_query(text: str) -> str:
+    """Turns free text into an FTS5 query matching all its words (as prefixes),
+    so user input never hits FTS5 syntax."""
+    return " ".join(f'"{word}"*' for word in _WORD.findall(text))
+
+
+class TimelineStore:
+    """Text messages of every room in SQLite, with an FTS5 index over bodies and
+    sender names. Also keeps, per room, the pagination token to backfill from."""
+
+    def __init__(self, path: str = MATRIX_TIMELINE_DB):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.executescript(
+                """
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                CREATE TABLE IF NOT EXISTS messages (
+                    event_id TEXT PRIMARY KEY,
+                    room_id TEXT NOT NULL,
+                    sender TEXT NOT NULL,
+                    sender_name TEXT,
+                    body TEXT NOT NULL,
+                    ts INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS messages_room_ts ON messages (room_id, ts);
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+                    body, sender_name, content='messages', content_rowid='rowid',
+                    tokenize='unicode61 remove_diacritics 2'
+                );
+                CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+                    INSERT INTO messages_fts (rowid, body, sender_name)
+                    VALUES (new.rowid, new.body, new.sender_name);
+                END;
+                CREATE TABLE IF NOT EXISTS backfill (
+                    room_id TEXT PRIMARY KEY,
+                    token TEXT,
+                    complete INTEGER NOT NULL DEFAULT 0
+                );
+                """
+            )
+            self._connection = connection
+        return self._connection
+
+    def add(self, messages: List[tuple[str, str, str, Optional[str], str, int]]) -> None:
+        """Adds (event_id, room_id, sender, sender_name, body, ts) rows, ignoring
+        the ones already stored."""
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.executemany(
+                    "INSERT OR IGNORE INTO messages (event_id, room_id, sender, sender_name, body, ts) VALUES (?, ?, ?, ?, ?, ?)",
+                    messages,
+                )
+
+    def last(self, room_id: str, limit: int) -> List[dict[str, Any]]:
+        with self._lock:
+            rows = (
+                self._connect()
+                .execute(
+                    "SELECT * FROM messages WHERE room_id = ? ORDER BY ts DESC LIMIT ?",
+                    (room_id, limit),
+                )
+                .fetchall()
+            )
+        return [dict(row) for row in reversed(rows)]
+
+    def search(
+        self,
+        text: Optional[str] = None,
+        room_ids: Optional[List[str]] = None,
+        sender: Optional[str] = None,
+        limit: int = 20,
+    ) -> List[dict[str, Any]]:
+        where, params = [], []
+        if text and fts_query(text):
+            where.append("messages.rowid IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)")
+            params.append(f"{{body}} : ({fts_query(text)})")
+        if room_ids is not None:
+            where.append(f"room_id IN ({', '.join('?' for _ in room_ids)})")
+            params += room_ids
+        if sender and fts_query(sender):
+            where.append("(messages.rowid IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?) OR sender LIKE ?)")
+            params += [f"{{sender_name}} : ({fts_query(sender)})", f"%{sender}%"]
+        query = "SELECT * FROM messages"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY ts DESC LIMIT ?"
+        with self._lock:
+            rows = self._connect().execute(query, (*params, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def backfill_state(self, room_id: str) -> tuple[Optional[str], bool]:
+        with self._lock:
+            row = (
+                self._connect()
+                .execute("SELECT token, complete FROM backfill WHERE room_id = ?", (room_id,))
+                .fetchone()
+            )
+        return (row["token"], bool(row["complete"])) if row else (None, False)
+
+    def set_backfill_state(self, room_id: str, token: Optional[str], complete: bool) -> None:
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO backfill (room_id, token, complete) VALUES (?, ?, ?)",
+                    (room_id, token, int(complete)),
+                )
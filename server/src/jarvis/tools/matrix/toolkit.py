@@ -1,11 +1,20 @@
 from typing import List
+from pydantic import Field
 from langchain_community.agent_toolkits.base import BaseToolkit
+from langchain_core.language_models import BaseChatModel
 from langchain_core.tools import BaseTool
 
+from jarvis.tools.matrix.digest import MatrixUnreadDigestTool
 from jarvis.tools.matrix.send_message import MatrixSendMessageTool
+from jarvis.tools.matrix.timeline import MatrixLastMessagesTool, MatrixSearchMessagesTool
 
 class MatrixToolkit(BaseToolkit):
+    llm: BaseChatModel = Field()
+
     def get_tools(self) -> List[BaseTool]:
         return [
             MatrixSendMessageTool(),
+            MatrixLastMessagesTool(),
+            MatrixSearchMessagesTool(),
+            MatrixUnreadDigestTool(llm=self.llm),
         ]
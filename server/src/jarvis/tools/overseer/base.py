@@ -7,6 +7,8 @@ class OverseerBaseTool(BaseTool):
     client: httpx.Client = Field(default_factory=lambda: httpx.Client(timeout=15))
     base_url: str = Field(default_factory=lambda: "")
     headers: dict = Field(default_factory=lambda: {})
+    # Replies used instead of another LLM call when return_direct is set, by language
+    response_templates: dict[str, str] = {}
 
     def __init__(self, api_key: str, base_url: str, **kwds):
         super(OverseerBaseTool, self).__init__(**kwds)
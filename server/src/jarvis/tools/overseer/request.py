@@ -24,6 +24,11 @@ class OverseerDownloadTool(OverseerBaseTool):
     name: str = "overseer_download"
     description: str = "Download a movie or TV series by its ID."
     args_schema: Type[BaseModel] = OverseerDownloadSchema
+    return_direct: bool = True
+    response_templates: dict[str, str] = {
+        "pt-BR": "Ok, vai ser baixado.",
+        "en": "OK, it will be downloaded.",
+    }
 
     def __init__(self, **kwds):
         super().__init__(**kwds)
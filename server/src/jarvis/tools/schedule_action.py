@@ -1,19 +1,71 @@
-import httpx
+import re
 import uuid
-import json
 import logging
 from datetime import datetime
-from typing import Type
+from typing import List, Optional, Type
 from pydantic import BaseModel, Field
 from langchain_core.tools import BaseTool
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.triggers.cron import CronTrigger
+
+from jarvis.graph.action_queue import action_queue
+from jarvis.scheduler import ACTIONS_JOBSTORE, SCHEDULER_TIMEZONE, scheduler
 
 _LOGGER = logging.getLogger(__name__)
 
+MAX_LISTED_JOBS = 50
+
+_CRONTAB_WEEKDAYS = ["sun", "mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+def _crontab_weekdays(field: str) -> str:
+    """Expands crontab's numeric weekdays (0 or 7 is Sunday, steps counted
+    from Sunday) into day names, which APScheduler reads the same way."""
+    if field == "*" or re.search(r"[a-z]", field, re.IGNORECASE):
+        return field
+    days: List[str] = []
+    for part in field.split(","):
+        base, _, step = part.partition("/")
+        if base == "*":
+            first, last = 0, 6
+        elif "-" in base:
+            first, last = (int(n) for n in base.split("-", 1))
+        else:
+            # "1/2" runs from 1 to the end of the week
+            first = int(base)
+            last = 7 if step else first
+        for day in range(first, last + 1, int(step or 1)):
+            if _CRONTAB_WEEKDAYS[day] not in days:
+                days.append(_CRONTAB_WEEKDAYS[day])
+    if not days:
+        raise ValueError(f"no weekdays in \"{field}\"")
+    return ",".join(days)
+
+
+def crontab_trigger(expression: str) -> CronTrigger:
+    """Like `CronTrigger.from_crontab`, but with crontab's weekday numbers
+    (0 or 7 is Sunday) instead of APScheduler's (0 is Monday), in the
+    scheduler's timezone (trigger objects don't inherit it)."""
+    fields = expression.split()
+    if len(fields) == 5:
+        fields[4] = _crontab_weekdays(fields[4])
+    return CronTrigger.from_crontab(" ".join(fields), timezone=SCHEDULER_TIMEZONE)
+
+
+async def run_instructions(instructions: str, plan: Optional[List[List[dict]]] = None):
+    # Module-level, so the job store can reference it by name. Only hands the
+    # instructions over to the action queue, the run isn't awaited.
+    action_queue.submit(instructions, plan)
+
 
 class ScheduleActionInput(BaseModel):
-    moment: datetime = Field(
-        description="At which time the action should be executed (RFC3339 timestamp with mandatory time zone offset, e.g., 2011-06-03T10:00:00-07:00, 2011-06-03T10:00:00Z). Required."
+    moment: Optional[datetime] = Field(
+        default=None,
+        description="At which time the action should be executed (RFC3339 timestamp with mandatory time zone offset, e.g., 2011-06-03T10:00:00-07:00, 2011-06-03T10:00:00Z). Required unless it's recurring.",
+    )
+    cron: Optional[str] = Field(
+        default=None,
+        description="For recurring actions, when to execute them as a crontab expression (minute hour day month weekday), e.g. \"0 7 * * 1-5\" for weekdays at 7a.m.",
     )
     instructions: str = Field(
         description="Complete instructions to execute the entire task as if it's time to execute it."
@@ -25,38 +77,99 @@ class ScheduleActionTool(BaseTool):
     description: str = """Use this when you want to schedule any action to be executed in the future by setting a timer and running a set of instructions.
 Provide complete instructions to execute the entire task as if it's time to execute it.
 For example, when the user request to "set an alarm for 4p.m.", the instructions should be "notify via default alexa device that alarm has expired"
-and when the user request to "at 4p.m, send a message to John saying wake up", the instructions should be "send a message to John: wake up"."""
+and when the user request to "at 4p.m, send a message to John saying wake up", the instructions should be "send a message to John: wake up".
+For recurring actions (e.g. "every weekday at 7a.m."), use cron instead of moment."""
     args_schema: Type[BaseModel] = ScheduleActionInput
 
-    client: httpx.Client = Field(default_factory=lambda: httpx.Client(timeout=90))
-    scheduler: BackgroundScheduler = Field(default_factory=lambda: BackgroundScheduler())
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+    def _trigger(self, moment: Optional[datetime], cron: Optional[str]) -> tuple[Optional[dict], str]:
+        """The trigger arguments and a description of when, or an error."""
+        if cron:
+            try:
+                return {"trigger": crontab_trigger(cron)}, f"on \"{cron}\""
+            except (ValueError, IndexError) as e:
+                return None, f"Sorry, I can't do that (invalid cron expression: {e})"
+        if moment:
+            return {"trigger": "date", "run_date": moment}, f"at {moment}"
+        return None, "Sorry, I can't do that (either moment or cron is required)"
+
+    def _schedule(self, instructions: str, trigger: dict, when: str, plan: Optional[List[List[dict]]] = None) -> str:
+        job = scheduler.add_job(
+            func=run_instructions,
+            args=[instructions, plan],
+            jobstore=ACTIONS_JOBSTORE,
+            id=uuid.uuid4().hex[:8],
+            name=instructions,
+            **trigger,
+        )
+        return f"The action \"{instructions}\" has been scheduled to run {when} (id {job.id})."
+
+    def _run(self, instructions: str, moment: Optional[datetime] = None, cron: Optional[str] = None) -> str:
+        trigger, when = self._trigger(moment, cron)
+        if trigger is None:
+            return when
+        return self._schedule(instructions, trigger, when)
 
-    class Config:
-        arbitrary_types_allowed = True
+    async def _arun(self, instructions: str, moment: Optional[datetime] = None, cron: Optional[str] = None) -> str:
+        trigger, when = self._trigger(moment, cron)
+        if trigger is None:
+            return when
+        # Resolving the tool calls now spares the LLM round-trips when it fires
+        plan = await action_queue.compile(instructions)
+        return self._schedule(instructions, trigger, when, plan)
+
+
+class ListScheduledActionsInput(BaseModel):
+    query: Optional[str] = Field(
+        default=None, description="Only list actions whose instructions contain this text."
+    )
+
+
+class ListScheduledActionsTool(BaseTool):
+    name: str = "list_scheduled_actions"
+    description: str = "Use this to list the scheduled actions (alarms, reminders, timers...) that haven't run yet."
+    args_schema: Type[BaseModel] = ListScheduledActionsInput
+
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+    def _run(self, query: Optional[str] = None) -> str:
+        jobs = [
+            job
+            for job in scheduler.get_jobs(ACTIONS_JOBSTORE)
+            if not query or query.casefold() in job.name.casefold()
+        ]
+        if not jobs:
+            return "No actions are scheduled."
+        lines = [
+            f"- {job.id}: \"{job.name}\" "
+            + (f"on \"{job.trigger}\", next " if isinstance(job.trigger, CronTrigger) else "")
+            + f"at {job.next_run_time.isoformat() if job.next_run_time else 'paused'}"
+            for job in jobs[:MAX_LISTED_JOBS]
+        ]
+        if len(jobs) > MAX_LISTED_JOBS:
+            lines.append(f"... and {len(jobs) - MAX_LISTED_JOBS} more.")
+        return "\n".join(lines)
+
+
+class CancelScheduledActionInput(BaseModel):
+    id: str = Field(description="Id of the scheduled action, as listed by list_scheduled_actions.")
+
+
+class CancelScheduledActionTool(BaseTool):
+    name: str = "cancel_scheduled_action"
+    description: str = "Use this to cancel a scheduled action (alarm, reminder, timer...) by its id."
+    args_schema: Type[BaseModel] = CancelScheduledActionInput
 
     def __init__(self, **kwds):
         super().__init__(**kwds)
-        self.scheduler = BackgroundScheduler()
-        self.scheduler.start()
-
-    def _run(self, moment: datetime, instructions: str) -> str:
-        scheduler: BackgroundScheduler = self.scheduler
-
-        def _run_instructions():
-            response = self.client.post(
-                "http://192.168.10.20:10055/invoke",
-                json={
-                    "input": instructions,
-                    "config": {"configurable": {"session_id": str(uuid.uuid4())}},
-                },
-            )
-            json_obj = response.json()
-            _LOGGER.debug(json_obj)
-            return (
-                json.dumps(json_obj)
-                if response.status_code == 200
-                else f"Sorry, I can't do that (got error {response.status_code})"
-            )
-
-        scheduler.add_job(func=_run_instructions, trigger="date", next_run_time=moment)
-        return f"The action \"{instructions}\" has been scheduled to run at {moment}."
+
+    def _run(self, id: str) -> str:
+        try:
+            job = scheduler.get_job(id, ACTIONS_JOBSTORE)
+            scheduler.remove_job(id, ACTIONS_JOBSTORE)
+        except JobLookupError:
+            return f"Sorry, I can't do that (no scheduled action with id {id})"
+        return f"The action \"{job.name if job else id}\" has been cancelled."